@@ -0,0 +1,92 @@
+import time
+from collections import deque
+
+
+class SlidingWindowLimiter:
+    """Ограничивает число событий по ключу за скользящее окно времени"""
+
+    def __init__(self, limit, window, sweep_threshold=10000):
+        self.limit = limit
+        self.window = window
+        self.sweep_threshold = sweep_threshold
+        self.hits = {}
+
+    def _trim(self, key, now):
+        """Отбрасывает события, вышедшие за окно, и возвращает оставшиеся"""
+        hits = self.hits.get(key)
+        if hits is None:
+            return None
+        border = now - self.window
+        while hits and hits[0] <= border:
+            hits.popleft()
+        return hits
+
+    def is_allowed(self, key, now):
+        """Проверяет, есть ли у ключа запас в текущем окне"""
+        hits = self._trim(key, now)
+        return hits is None or len(hits) < self.limit
+
+    def hit(self, key, now):
+        """Учитывает событие для ключа"""
+        hits = self.hits.get(key)
+        if hits is None:
+            if len(self.hits) >= self.sweep_threshold:
+                self.sweep(now)
+            # Хранить больше limit отметок не нужно
+            hits = self.hits[key] = deque(maxlen=self.limit)
+        hits.append(now)
+
+    def sweep(self, now):
+        """Удаляет ключи без событий в текущем окне"""
+        border = now - self.window
+        stale = [key for key, hits in self.hits.items() if not hits or hits[-1] <= border]
+        for key in stale:
+            del self.hits[key]
+
+
+class AntiSpam:
+    """Бан-лист и лимиты отправки для отправителей анонимных сообщений"""
+
+    # Ключи настроек в таблице settings
+    SETTINGS = ('antispam_sender_limit', 'antispam_pair_limit', 'antispam_window')
+
+    def __init__(self, sender_limit=20, pair_limit=5, window=60):
+        self.banned = set()
+        self.configure(sender_limit, pair_limit, window)
+
+    def configure(self, sender_limit, pair_limit, window):
+        """Задает лимиты; накопленная история сбрасывается"""
+        self.sender_limit = sender_limit
+        self.pair_limit = pair_limit
+        self.window = window
+        self.per_sender = SlidingWindowLimiter(sender_limit, window)
+        self.per_pair = SlidingWindowLimiter(pair_limit, window)
+
+    def load(self, db):
+        """Загружает бан-лист и сохраненные админом лимиты из базы"""
+        self.banned = set(db.get_banned_users())
+        self.configure(
+            int(db.get_setting('antispam_sender_limit', self.sender_limit)),
+            int(db.get_setting('antispam_pair_limit', self.pair_limit)),
+            int(db.get_setting('antispam_window', self.window))
+        )
+
+    def save(self, db):
+        """Сохраняет текущие лимиты в базу"""
+        db.set_setting('antispam_sender_limit', self.sender_limit)
+        db.set_setting('antispam_pair_limit', self.pair_limit)
+        db.set_setting('antispam_window', self.window)
+
+    def check(self, sender_id, recipient_id):
+        """Возвращает причину отказа ('banned' или 'rate') либо None и учитывает отправку"""
+        if sender_id in self.banned:
+            return 'banned'
+
+        now = time.monotonic()
+        pair = (sender_id, recipient_id)
+        if not self.per_sender.is_allowed(sender_id, now) or not self.per_pair.is_allowed(pair, now):
+            return 'rate'
+
+        self.per_sender.hit(sender_id, now)
+        self.per_pair.hit(pair, now)
+        return None
@@ -0,0 +1,189 @@
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+
+def backup_file(conn, target_path, schema='main', pages=100, pause=0.01):
+    """Копирует базу через backup API по pages страниц за шаг и сжимает копию.
+
+    conn - рабочее соединение бота: изменения, которые бот пишет через него
+    во время копирования, попадают в копию без перезапуска backup.
+    После каждого шага копирование засыпает на pause секунд: между шагами
+    блокировок нет, и бот успевает записывать. Параметр sleep у backup() тут
+    не подходит - CPython ждет его только после шага, вернувшего BUSY/LOCKED.
+    Копирование идет не быстрее pages / pause страниц в секунду: при более
+    быстром росте базы оно не закончится.
+    """
+    fd, raw_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(target_path))
+    os.close(fd)
+    try:
+        target = sqlite3.connect(raw_path)
+        try:
+            progress = (lambda status, remaining, total: time.sleep(pause) if remaining else None) if pause else None
+            conn.backup(target, pages=pages, name=schema, progress=progress)
+        finally:
+            target.close()
+        with open(raw_path, 'rb') as src, gzip.open(target_path, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    finally:
+        os.remove(raw_path)
+    return os.path.getsize(target_path)
+
+
+def create_backup(databases, backup_dir, pages=100, pause=0.01, keep=7):
+    """Делает резервную копию всех файлов базы в новый каталог и удаляет старые копии.
+
+    Возвращает (каталог, [(файл, размер)], секунд).
+    """
+    started = time.monotonic()
+    out_dir = os.path.join(backup_dir, datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(out_dir, exist_ok=True)
+
+    files = []
+    for db in databases:
+        sources = [('main', db.db_name)]
+        if db.archive_path:
+            sources.append(('archive', db.archive_path))
+        for schema, path in sources:
+            target_path = os.path.join(out_dir, os.path.basename(path) + '.gz')
+            files.append((target_path, backup_file(db.conn, target_path, schema, pages, pause)))
+
+    rotate_backups(backup_dir, keep)
+    return out_dir, files, time.monotonic() - started
+
+
+def list_backups(backup_dir):
+    """Каталоги резервных копий, новые первыми"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [name for name in os.listdir(backup_dir) if os.path.isdir(os.path.join(backup_dir, name))]
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+
+def rotate_backups(backup_dir, keep):
+    """Оставляет keep самых новых копий"""
+    for path in list_backups(backup_dir)[keep:]:
+        shutil.rmtree(path)
+
+
+def restore_backup(backup_dir, target_dir):
+    """Распаковывает копию в target_dir, проверяя целостность каждого файла.
+
+    Бот должен быть остановлен: файлы базы заменяются целиком.
+    """
+    restored = []
+    for name in sorted(os.listdir(backup_dir)):
+        if not name.endswith('.gz'):
+            continue
+        target_path = os.path.join(target_dir, name[:-len('.gz')])
+        raw_path = target_path + '.restore'
+        with gzip.open(os.path.join(backup_dir, name), 'rb') as src, open(raw_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        conn = sqlite3.connect(raw_path)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        if result != 'ok':
+            os.remove(raw_path)
+            raise ValueError(f"{name}: проверка целостности не пройдена: {result}")
+
+        # Старые WAL и shm относятся к заменяемому файлу
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(target_path + suffix):
+                os.remove(target_path + suffix)
+        os.replace(raw_path, target_path)
+        restored.append(target_path)
+    return restored
+
+
+def benchmark(db_path, messages, pages, pause):
+    """Задержка и скорость записи сообщений без резервного копирования и во время него"""
+    from database import Database
+
+    db = Database(db_path)
+    for _ in range(messages):
+        db.save_anonymous_message(1, 2, 'bench', 'Bench', 'x' * 200)
+
+    def measure(count):
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            db.save_anonymous_message(1, 2, 'bench', 'Bench', 'benchmark message')
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    started = time.perf_counter()
+    results = {'без копирования': (measure(500), time.perf_counter() - started)}
+
+    # Без паузы копирование занимает соединение почти без перерывов, с паузой запись идет между шагами
+    for label, step_pause in (('копирование, пауза 0', 0), (f'копирование, пауза {pause}', pause)):
+        with tempfile.TemporaryDirectory() as backup_dir:
+            worker = threading.Thread(target=create_backup, args=([db], backup_dir, pages, step_pause))
+            started = time.perf_counter()
+            worker.start()
+            latencies = []
+            while worker.is_alive():
+                latencies.extend(measure(1))
+            worker.join()
+            results[label] = (latencies, time.perf_counter() - started)
+
+    for label, (latencies, elapsed) in results.items():
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+        print(f"{label}: {elapsed:.2f} с, {len(latencies)} записей ({len(latencies) / elapsed:.0f}/с), "
+              f"медиана {statistics.median(latencies):.2f} мс, p95 {p95:.2f} мс, максимум {latencies[-1]:.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резервные копии базы бота")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    create = commands.add_parser('create', help="сделать копию (можно при работающем боте)")
+    create.add_argument('--db', default='bot_database.db')
+    create.add_argument('--out', default='backups')
+    create.add_argument('--keep', type=int, default=7)
+
+    commands.add_parser('list', help="список копий").add_argument('--out', default='backups')
+
+    restore = commands.add_parser('restore', help="восстановить копию (бот должен быть остановлен)")
+    restore.add_argument('backup', help="каталог копии, например backups/20240101-030000")
+    restore.add_argument('--to', default='.', help="куда распаковать файлы базы")
+
+    bench = commands.add_parser('bench', help="задержка записи во время копирования")
+    bench.add_argument('--db', default='backup_bench.db')
+    bench.add_argument('--messages', type=int, default=20000)
+    bench.add_argument('--pages', type=int, default=100)
+    bench.add_argument('--pause', type=float, default=0.01)
+
+    args = parser.parse_args()
+    if args.command == 'create':
+        conn = sqlite3.connect(args.db)
+        try:
+            out_dir = os.path.join(args.out, datetime.now().strftime("%Y%m%d-%H%M%S"))
+            os.makedirs(out_dir, exist_ok=True)
+            size = backup_file(conn, os.path.join(out_dir, os.path.basename(args.db) + '.gz'))
+        finally:
+            conn.close()
+        rotate_backups(args.out, args.keep)
+        print(f"{out_dir}: {size} байт")
+    elif args.command == 'list':
+        for path in list_backups(args.out):
+            print(path)
+    elif args.command == 'restore':
+        for path in restore_backup(args.backup, args.to):
+            print(f"восстановлен {path}")
+    else:
+        benchmark(args.db, args.messages, args.pages, args.pause)
+
+
+if __name__ == '__main__':
+    main()
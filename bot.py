@@ -1,11 +1,51 @@
 import logging
+import asyncio
+import os
+import tempfile
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, 
-    filters, ContextTypes, CallbackQueryHandler
+    CommandHandler, MessageHandler, 
+    filters, ContextTypes, CallbackQueryHandler, TypeHandler
+)
+from datetime import datetime, timedelta
+from config import (
+    TOKEN, ADMIN_IDS, BOT_USERNAME, STATS_REFRESH_INTERVAL, ADMIN_PAGE_SIZE, SEARCH_PAGE_SIZE,
+    THREAD_PAGE_SIZE, RETENTION_DAYS, RETENTION_INCLUDE_UNREAD, RETENTION_BATCH_SIZE,
+    RETENTION_INTERVAL, ARCHIVE_DB_PATH, ARCHIVE_COMPRESS, NOTIFY_COALESCE_WINDOW, NOTIFY_EDIT_INTERVAL,
+    ANTISPAM_SENDER_LIMIT, ANTISPAM_PAIR_LIMIT, ANTISPAM_WINDOW,
+    BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_CHUNK_SIZE, ALBUM_WINDOW, DB_SHARDS,
+    TELEGRAM_POOL_SIZE, TELEGRAM_UPDATES_POOL_SIZE, TELEGRAM_HTTP_VERSION, TELEGRAM_CONNECT_TIMEOUT,
+    TELEGRAM_READ_TIMEOUT, TELEGRAM_WRITE_TIMEOUT, TELEGRAM_POOL_TIMEOUT, TELEGRAM_MEDIA_TIMEOUT,
+    MAINTENANCE_INTERVAL, MAINTENANCE_WINDOW, MAINTENANCE_VACUUM_STEP,
+    BACKUP_DIR, BACKUP_INTERVAL, BACKUP_KEEP, BACKUP_PAGES, BACKUP_PAUSE,
+    PROFILE_INTERVAL, PROFILE_SECONDS, PROFILE_MAX_SECONDS,
+    CONVERSATION_TTL, CONVERSATION_SWEEP_INTERVAL, TRACEMALLOC_FRAMES,
+    LOOP_LAG_INTERVAL, LOOP_STALL_THRESHOLD, SLOW_HANDLER_THRESHOLD,
+    CAPTURE_PATH, CAPTURE_SALT,
+    OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_BASE_DELAY, OUTBOX_MAX_DELAY, OUTBOX_POLL_INTERVAL,
+    OUTBOX_KEEP_DAYS
 )
-from config import TOKEN, ADMIN_IDS, BOT_USERNAME
 from database import Database
+from sharding import ShardedDatabase
+from export import export_database, database_sources, EXPORT_FORMATS
+from retention import RetentionPolicy
+from maintenance import DatabaseMaintenance, parse_window, format_size
+from backup import create_backup
+from profiler import SamplingProfiler
+from memory import ConversationJanitor, MemoryTracker, deep_size, format_stat, rss_bytes
+from loop_monitor import LoopLagMonitor
+from capture import UpdateRecorder
+from notifications import NotificationCoalescer
+from outbox import OutboxWorker
+from antispam import AntiSpam
+from broadcast import Broadcaster
+from router import CallbackRouter
+from templates import Templates, MenuCache
+from media import AlbumCollector, media_group
+from stats import StatsCache
+from http_client import POOLS_KEY, application_builder, format_pool_stats
 
 # Настройка логирования
 logging.basicConfig(
@@ -14,8 +54,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация базы данных
-db = Database()
+# Инициализация базы данных (при DB_SHARDS > 1 сообщения раскладываются по нескольким файлам)
+if DB_SHARDS > 1:
+    db = ShardedDatabase(shards=DB_SHARDS, archive_path=ARCHIVE_DB_PATH or None)
+else:
+    db = Database(archive_path=ARCHIVE_DB_PATH or None)
+
+# Объединение частых уведомлений одному получателю
+notifier = NotificationCoalescer(window=NOTIFY_COALESCE_WINDOW, edit_interval=NOTIFY_EDIT_INTERVAL)
+
+# Антиспам: лимиты и бан-лист держим в памяти, проверка не трогает базу
+antispam = AntiSpam(ANTISPAM_SENDER_LIMIT, ANTISPAM_PAIR_LIMIT, ANTISPAM_WINDOW)
+antispam.load(db)
+
+# Клавиатуры и тексты меню собираются один раз, меню пользователей кэшируются
+templates = Templates(BOT_USERNAME)
+menu_cache = MenuCache(db, templates)
+
+# Фото альбома приходят отдельными обновлениями и собираются в одно сообщение
+albums = AlbumCollector(window=ALBUM_WINDOW)
+
+# Рассылка всем пользователям
+broadcaster = Broadcaster(db, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY, chunk_size=BROADCAST_CHUNK_SIZE)
+
+# Перенос старых сообщений в архив
+retention_policy = RetentionPolicy(
+    days=RETENTION_DAYS,
+    include_unread=RETENTION_INCLUDE_UNREAD,
+    batch_size=RETENTION_BATCH_SIZE,
+    compress=ARCHIVE_COMPRESS
+)
+
+# Обслуживание файлов базы (и шардов, если они есть) в тихие часы
+maintenance = DatabaseMaintenance(
+    [db] + getattr(db, 'shards', []),
+    window=parse_window(MAINTENANCE_WINDOW),
+    vacuum_step=MAINTENANCE_VACUUM_STEP
+)
+
+# Доставка уведомлений получателям из outbox (в шардированной базе - из каждого шарда)
+outbox = OutboxWorker(
+    [db] + getattr(db, 'shards', []),
+    build=lambda bot, message_id: build_notification(bot, message_id),
+    notifier=notifier,
+    batch_size=OUTBOX_BATCH_SIZE,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    base_delay=OUTBOX_BASE_DELAY,
+    max_delay=OUTBOX_MAX_DELAY,
+    poll_interval=OUTBOX_POLL_INTERVAL,
+    keep_days=OUTBOX_KEEP_DAYS,
+    # Влитое уведомление ждет правки: не дольше интервала правок с запасом
+    lease=NOTIFY_EDIT_INTERVAL + 60
+)
+
+# Одна резервная копия за раз
+backup_lock = asyncio.Lock()
+
+# Профайлер живого бота по запросу админа
+profiler = SamplingProfiler(interval=PROFILE_INTERVAL)
+
+# Учет памяти: брошенные диалоги удаляются, снимки tracemalloc по запросу админа
+janitor = ConversationJanitor(ttl=CONVERSATION_TTL)
+memory_tracker = MemoryTracker(frames=TRACEMALLOC_FRAMES)
+
+# Задержка цикла событий и медленные обработчики (обработчики работают с sqlite синхронно)
+lag_monitor = LoopLagMonitor(
+    interval=LOOP_LAG_INTERVAL,
+    stall_threshold=LOOP_STALL_THRESHOLD,
+    slow_handler_threshold=SLOW_HANDLER_THRESHOLD
+)
+
+# Захват трафика для повтора через replay.py (включается CAPTURE_PATH)
+recorder = UpdateRecorder(
+    CAPTURE_PATH, admin_ids=ADMIN_IDS, salt=CAPTURE_SALT.encode() or None, resolve_link=db.get_user_by_link
+) if CAPTURE_PATH else None
+
+# Снимок статистики для админ-панели
+stats_cache = StatsCache(db, ttl=STATS_REFRESH_INTERVAL)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
@@ -23,8 +138,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Проверяем, является ли пользователь администратором
     is_admin = user.id in ADMIN_IDS
-    if is_admin:
-        db.set_admin(user.id)
     
     if context.args:
         # Пользователь перешел по ссылке
@@ -33,7 +146,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if recipient_id and recipient_id != user.id:
             context.user_data['recipient'] = recipient_id
-            context.user_data['conversation_with'] = recipient_id
             await update.message.reply_text(
                 "🔒 Вы перешли по ссылке для отправки анонимного сообщения.\n"
                 "📝 Отправьте текст или фото (можно с подписью):"
@@ -44,30 +156,41 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Недействительная ссылка.")
     else:
         # Обычный запуск
-        unique_link = db.add_user(user.id, user.username, user.first_name)
-        bot_link = f"https://t.me/{BOT_USERNAME}?start={unique_link}"
-        unread_count = db.get_unread_count(user.id)
-        
-        welcome_message = (
-            f"👋 Привет, {user.first_name}!\n\n"
-            f"🔗 Твоя ссылка для анонимных сообщений:\n"
-            f"`{bot_link}`\n\n"
-            f"📊 Непрочитанных: {unread_count}\n\n"
-            f"📸 Можно отправлять фото с подписями!"
+        db.add_user(user.id, user.username, user.first_name, is_admin=is_admin)
+        welcome_message = menu_cache.get('start', user.id, user.first_name, is_admin)
+        await update.message.reply_text(
+            welcome_message, reply_markup=templates.menu_keyboard(is_admin), parse_mode='Markdown'
         )
-        
-        keyboard = [
-            [InlineKeyboardButton("📨 Мои сообщения", callback_data="my_messages")],
-            [InlineKeyboardButton("🔄 Моя ссылка", callback_data="my_link")],
-            [InlineKeyboardButton("❓ Помощь", callback_data="help")]
-        ]
-        
-        if is_admin:
-            keyboard.append([InlineKeyboardButton("👑 Админ-панель", callback_data="admin_panel")])
-            welcome_message += "\n\n👑 **Вы администратор!**"
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
+
+def load_callback_message(message_id, user_id, is_admin):
+    """Загружает сообщение для обработчиков кнопок"""
+    return db.get_message_by_id(message_id, requesting_user_id=user_id)
+
+# Маршрутизатор кнопок: код действия из callback_data -> обработчик
+router = CallbackRouter(is_admin=lambda user_id: user_id in ADMIN_IDS, message_loader=load_callback_message)
+cb = router.encode
+
+async def is_spam(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Проверяет отправку по бан-листу и лимитам до записи в базу"""
+    user_id = update.effective_user.id
+    if user_id in ADMIN_IDS:
+        return False
+    
+    if 'recipient' in context.user_data:
+        recipient_id = context.user_data['recipient']
+    elif 'replying_to' in context.user_data:
+        recipient_id = context.user_data['replying_to']['sender_id']
+    else:
+        return False
+    
+    reason = antispam.check(user_id, recipient_id)
+    if reason == 'banned':
+        await update.message.reply_text("🚫 Вы не можете отправлять сообщения.")
+        return True
+    if reason == 'rate':
+        await update.message.reply_text("⏳ Слишком много сообщений. Подождите немного и попробуйте снова.")
+        return True
+    return False
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
@@ -75,64 +198,41 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         message_text = update.message.text
         
+        if await is_spam(update, context):
+            return
+        
         if 'recipient' in context.user_data:
             # Отправка нового сообщения
             recipient_id = context.user_data['recipient']
-            message_id = db.save_anonymous_message(
+            await db.save_anonymous_message_async(
                 recipient_id=recipient_id,
                 sender_id=user.id,
                 sender_username=user.username,
                 sender_first_name=user.first_name,
-                message_text=message_text
+                message_text=message_text,
+                notify=True
             )
             del context.user_data['recipient']
+            menu_cache.invalidate(recipient_id)
+            outbox.wake()
             await update.message.reply_text("✅ Сообщение отправлено!")
-            
-            # Отправляем уведомление с кнопкой ответа
-            try:
-                unread_count = db.get_unread_count(recipient_id)
-                keyboard = [[InlineKeyboardButton("💬 Ответить", callback_data=f"quick_reply_{message_id}")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await context.bot.send_message(
-                    chat_id=recipient_id,
-                    text=f"📩 **Новое анонимное сообщение!**\n\n"
-                         f"📝 {message_text[:100]}{'...' if len(message_text) > 100 else ''}\n\n"
-                         f"💬 Нажмите кнопку ниже чтобы ответить",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление: {e}")
         
         elif 'replying_to' in context.user_data:
             # Ответ на сообщение
             reply_data = context.user_data['replying_to']
-            message_id = db.save_anonymous_message(
+            await db.save_anonymous_message_async(
                 recipient_id=reply_data['sender_id'],
                 sender_id=user.id,
                 sender_username=user.username,
                 sender_first_name=user.first_name,
                 message_text=message_text,
-                reply_to_id=reply_data['message_id']
+                reply_to_id=reply_data['message_id'],
+                notify=True
             )
             del context.user_data['replying_to']
+            menu_cache.invalidate(reply_data['sender_id'])
+            outbox.wake()
             await update.message.reply_text("✅ Ответ отправлен!")
-            
-            # Уведомляем о ответе
-            try:
-                keyboard = [[InlineKeyboardButton("💬 Ответить", callback_data=f"quick_reply_{message_id}")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await context.bot.send_message(
-                    chat_id=reply_data['sender_id'],
-                    text=f"📩 **Новый ответ на ваше сообщение!**\n\n"
-                         f"📝 {message_text[:100]}{'...' if len(message_text) > 100 else ''}",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-            except:
-                pass
         
         else:
             await update.message.reply_text("Используйте /start")
@@ -147,367 +247,798 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         photo = update.message.photo[-1]  # Берем самое большое фото
         caption = update.message.caption or ""  # Подпись к фото
+        media_group_id = update.message.media_group_id
+        
+        # Следующие фото альбома присоединяются к уже открытому альбому
+        if media_group_id and albums.add(user.id, media_group_id, photo, caption):
+            return
+        
+        if await is_spam(update, context):
+            if media_group_id:
+                albums.discard(user.id, media_group_id)
+            return
         
         if 'recipient' in context.user_data:
             # Отправка фото новому получателю
-            recipient_id = context.user_data['recipient']
-            message_id = db.save_anonymous_message(
-                recipient_id=recipient_id,
-                sender_id=user.id,
-                sender_username=user.username,
-                sender_first_name=user.first_name,
-                message_text=caption,
-                photo_file_id=photo.file_id
-            )
-            del context.user_data['recipient']
-            await update.message.reply_text("✅ Фото отправлено!")
-            
-            # Отправляем уведомление с фото
-            try:
-                keyboard = [[InlineKeyboardButton("💬 Ответить", callback_data=f"quick_reply_{message_id}")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await context.bot.send_photo(
-                    chat_id=recipient_id,
-                    photo=photo.file_id,
-                    caption=f"📩 **Новое анонимное фото!**\n\n{caption if caption else 'Без подписи'}",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление: {e}")
-        
+            recipient_id = context.user_data.pop('recipient')
+            reply_to_id = None
         elif 'replying_to' in context.user_data:
             # Ответ фото на сообщение
-            reply_data = context.user_data['replying_to']
-            message_id = db.save_anonymous_message(
-                recipient_id=reply_data['sender_id'],
-                sender_id=user.id,
-                sender_username=user.username,
-                sender_first_name=user.first_name,
-                message_text=caption,
-                photo_file_id=photo.file_id,
-                reply_to_id=reply_data['message_id']
-            )
-            del context.user_data['replying_to']
-            await update.message.reply_text("✅ Ответ с фото отправлен!")
-            
-            # Уведомляем о ответе с фото
-            try:
-                keyboard = [[InlineKeyboardButton("💬 Ответить", callback_data=f"quick_reply_{message_id}")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await context.bot.send_photo(
-                    chat_id=reply_data['sender_id'],
-                    photo=photo.file_id,
-                    caption=f"📩 **Новый ответ с фото!**\n\n{caption if caption else 'Без подписи'}",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-            except:
-                pass
-        
+            reply_data = context.user_data.pop('replying_to')
+            recipient_id = reply_data['sender_id']
+            reply_to_id = reply_data['message_id']
         else:
+            # Остальные фото альбома уйдут в пустой альбом без повторного ответа
+            if media_group_id:
+                albums.discard(user.id, media_group_id)
             await update.message.reply_text("Используйте /start чтобы получить ссылку")
+            return
+        
+        if media_group_id:
+            albums.open(user.id, media_group_id, photo, caption, lambda album: deliver_photos(
+                update, context, recipient_id, reply_to_id, album.photos, album.caption
+            ))
+        else:
+            await deliver_photos(update, context, recipient_id, reply_to_id, [photo], caption)
             
     except Exception as e:
         logger.error(f"Ошибка в handle_photo: {e}")
         await update.message.reply_text("❌ Произошла ошибка при отправке фото.")
 
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик нажатий на кнопки"""
+async def deliver_photos(update, context, recipient_id, reply_to_id, photos, caption):
+    """Сохраняет фото или альбом одним сообщением вместе с уведомлением получателю"""
+    user = update.effective_user
+    await db.save_anonymous_message_async(
+        recipient_id=recipient_id,
+        sender_id=user.id,
+        sender_username=user.username,
+        sender_first_name=user.first_name,
+        message_text=caption,
+        media=[(photo.file_id, photo.file_unique_id) for photo in photos],
+        reply_to_id=reply_to_id,
+        notify=True
+    )
+    menu_cache.invalidate(recipient_id)
+    outbox.wake()
+    if reply_to_id:
+        await update.message.reply_text("✅ Ответ с фото отправлен!")
+    else:
+        await update.message.reply_text("✅ Альбом отправлен!" if len(photos) > 1 else "✅ Фото отправлено!")
+
+def with_plain_fallback(send):
+    """Отправка send(parse_mode) с Markdown, а если Telegram не разобрал разметку - без нее"""
+    async def attempt():
+        try:
+            return await send('Markdown')
+        except BadRequest as e:
+            if "can't parse entities" not in str(e).lower():
+                raise
+            logger.warning(f"Уведомление не разобрано как Markdown, отправляю без разметки: {e}")
+            return await send(None)
+    return attempt
+
+def build_notification(bot, message_id):
+    """Собирает уведомление получателю из сохраненного сообщения: (отправка, is_photo, is_album)"""
+    message = db.get_message_by_id(message_id)
+    if message is None:
+        return None
+    recipient_id = message.recipient_id
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("💬 Ответить", callback_data=cb("qr", message.id))]])
+    
+    # Текст пользователя экранируется: "_" или "*" в нем не должны ломать разметку уведомления
+    if not message.media_count:
+        text = message.text or ""
+        preview = f"📝 {escape_markdown(text[:100])}{'...' if len(text) > 100 else ''}"
+        if message.reply_to_id:
+            text = f"📩 **Новый ответ на ваше сообщение!**\n\n{preview}"
+        else:
+            text = f"📩 **Новое анонимное сообщение!**\n\n{preview}\n\n💬 Нажмите кнопку ниже чтобы ответить"
+        return with_plain_fallback(lambda parse_mode: bot.send_message(
+            chat_id=recipient_id, text=text, reply_markup=reply_markup, parse_mode=parse_mode
+        )), False, False
+    
+    is_album = message.media_count > 1
+    if message.reply_to_id:
+        title = "📩 **Новый ответ с фото!**"
+    elif is_album:
+        title = f"📩 **Новый анонимный альбом ({message.media_count} фото)!**"
+    else:
+        title = "📩 **Новое анонимное фото!**"
+    text = f"{title}\n\n{escape_markdown(message.text) if message.text else 'Без подписи'}"
+    if is_album:
+        # Альбом уходит одним запросом; кнопки у альбома нет, ответить можно из «Мои сообщения»
+        caption = text + "\n\n💬 Ответить: «Мои сообщения»"
+        return with_plain_fallback(lambda parse_mode: bot.send_media_group(
+            chat_id=recipient_id, media=media_group(message.media, caption, parse_mode)
+        )), False, True
+    return with_plain_fallback(lambda parse_mode: bot.send_photo(
+        chat_id=recipient_id, photo=message.photo_id, caption=text,
+        reply_markup=reply_markup, parse_mode=parse_mode
+    )), True, False
+
+def parse_message_filters(args):
+    """Разбирает аргументы команды /messages в фильтры выборки"""
+    message_filters = {}
+    for arg in args:
+        key, _, value = arg.partition("=")
+        key = key.lower()
+        if key == "to":
+            message_filters['recipient_id'] = int(value)
+        elif key == "from":
+            message_filters['sender_id'] = int(value)
+        elif key == "since":
+            datetime.strptime(value, "%Y-%m-%d")
+            message_filters['date_from'] = value
+        elif key == "until":
+            # Дата включительно: берем все до начала следующего дня
+            day = datetime.strptime(value, "%Y-%m-%d") + timedelta(days=1)
+            message_filters['date_to'] = day.strftime("%Y-%m-%d")
+        elif key in ("photo", "nophoto"):
+            message_filters['has_photo'] = key == "photo"
+        elif key in ("unread", "read"):
+            message_filters['unread'] = key == "unread"
+        else:
+            raise ValueError(f"Неизвестный фильтр: {arg}")
+    return message_filters
+
+def describe_message_filters(message_filters):
+    """Формирует краткое описание активных фильтров"""
+    parts = []
+    if 'recipient_id' in message_filters:
+        parts.append(f"кому {message_filters['recipient_id']}")
+    if 'sender_id' in message_filters:
+        parts.append(f"от {message_filters['sender_id']}")
+    if 'date_from' in message_filters:
+        parts.append(f"с {message_filters['date_from']}")
+    if 'date_to' in message_filters:
+        parts.append(f"до {message_filters['date_to']}")
+    if 'has_photo' in message_filters:
+        parts.append("с фото" if message_filters['has_photo'] else "без фото")
+    if 'unread' in message_filters:
+        parts.append("непрочитанные" if message_filters['unread'] else "прочитанные")
+    return ", ".join(parts)
+
+def build_admin_users_page(after_user_id=None):
+    """Формирует страницу списка пользователей для админа"""
+    users, next_cursor = db.get_users_page(after_user_id, limit=ADMIN_PAGE_SIZE)
+    text = "👥 **Все пользователи:**\n\n"
+    for uid, username, name, date, link, admin in users:
+        username_display = f"@{username}" if username else "Нет username"
+        text += (f"• **{name}**\n"
+                f"  📱 {username_display}\n"
+                f"  🆔 `{uid}`\n"
+                f"  📅 {date.split()[0] if date else 'Нет'}\n"
+                f"  {'👑 Админ' if admin else '👤 Пользователь'}\n\n")
+    if not users:
+        text += "Пользователей нет\n"
+    
+    navigation = []
+    if after_user_id is not None:
+        navigation.append(InlineKeyboardButton("⏮ В начало", callback_data=cb("adm_users")))
+    if next_cursor is not None:
+        navigation.append(InlineKeyboardButton("➡️ Далее", callback_data=cb("adm_users", next_cursor)))
+    
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=cb("adm"))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+def build_admin_messages_page(message_filters, before_id=None):
+    """Формирует страницу списка сообщений для админа с учетом фильтров"""
+    messages, next_cursor = db.get_messages_page(before_id, limit=ADMIN_PAGE_SIZE, **message_filters)
+    text = "📨 **Сообщения:**\n"
+    if message_filters:
+        text += f"🔎 Фильтр: {describe_message_filters(message_filters)}\n"
+    text += "\n"
+    
+    for msg_id, s_id, s_user, s_name, r_id, msg_txt, media_count, date, is_read, r_user, r_name in messages:
+        text += (f"• **#{msg_id}**\n"
+                f"  👤 **От:** {s_name} (@{s_user})\n"
+                f"  👥 **Кому:** {r_name}\n"
+                f"  📅 {date}\n"
+                f"  {'📸 Фото' if media_count else '📝 Текст'}: {msg_txt[:50] if msg_txt else 'Без текста'}{'...' if msg_txt and len(msg_txt) > 50 else ''}\n"
+                f"  {'✅ Прочитано' if is_read else '📌 Непрочитано'}\n\n")
+    if not messages:
+        text += "Сообщений не найдено\n"
+    
+    navigation = []
+    if before_id is not None:
+        navigation.append(InlineKeyboardButton("⏮ В начало", callback_data=cb("adm_msgs")))
+    if next_cursor is not None:
+        navigation.append(InlineKeyboardButton("➡️ Далее", callback_data=cb("adm_msgs", next_cursor)))
+    
+    keyboard = [navigation] if navigation else []
+    if message_filters:
+        keyboard.append([InlineKeyboardButton("❌ Сбросить фильтр", callback_data=cb("adm_freset"))])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=cb("adm"))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def messages_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /messages - фильтр сообщений для админа"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
     try:
-        query = update.callback_query
-        await query.answer()
-        
-        user_id = update.effective_user.id
-        is_admin = user_id in ADMIN_IDS
-        
-        # === БЫСТРЫЙ ОТВЕТ ИЗ УВЕДОМЛЕНИЯ ===
-        if query.data.startswith("quick_reply_"):
-            message_id = int(query.data.split("_")[2])
-            message = db.get_message_by_id(message_id, requesting_user_id=user_id)
-            
-            if message:
-                if is_admin:
-                    # Для админа: id, sender_id, s_username, s_name, recipient_id, msg_text, photo_id, sent_date, reply_to_id
-                    if len(message) >= 9:
-                        msg_id, sender_id, s_username, s_name, recipient_id, msg_text, photo_id, sent_date, reply_to_id = message[:9]
-                    else:
-                        await query.edit_message_text("❌ Ошибка загрузки сообщения")
-                        return
-                else:
-                    # Для обычных: id, recipient_id, msg_text, photo_id, sent_date, reply_to_id
-                    if len(message) >= 6:
-                        msg_id, recipient_id, msg_text, photo_id, sent_date, reply_to_id = message[:6]
-                        sender_id = recipient_id
-                    else:
-                        await query.edit_message_text("❌ Ошибка загрузки сообщения")
-                        return
-                
-                context.user_data['replying_to'] = {
-                    'message_id': msg_id,
-                    'sender_id': sender_id,
-                    'original_text': msg_text,
-                    'photo_id': photo_id
-                }
-                
-                if photo_id:
-                    await query.edit_message_text(
-                        f"✏️ **Вы отвечаете на фото:**\n\n"
-                        f"Подпись: {msg_text if msg_text else 'Без подписи'}\n\n"
-                        f"Отправьте ваш ответ (текст или фото):",
-                        parse_mode='Markdown'
-                    )
-                else:
-                    await query.edit_message_text(
-                        f"✏️ **Вы отвечаете на сообщение:**\n"
-                        f"\"{msg_text[:100]}{'...' if len(msg_text) > 100 else ''}\"\n\n"
-                        f"Отправьте ваш ответ (текст или фото):",
-                        parse_mode='Markdown'
-                    )
-            return
-        
-        # === ГЛАВНОЕ МЕНЮ ===
-        elif query.data == "my_messages":
-            messages = db.get_user_messages(user_id, requesting_user_id=user_id)
-            
-            if not messages:
-                await query.edit_message_text("📭 У вас нет сообщений")
-                keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]]
-                await query.message.reply_text("Выберите действие:", reply_markup=InlineKeyboardMarkup(keyboard))
-                return
-            
-            await query.edit_message_text("📨 **Ваши сообщения:**", parse_mode='Markdown')
-            
-            for msg in messages:
-                if is_admin:
-                    # Для админа
-                    if len(msg) >= 9:
-                        msg_id, sender_id, s_username, s_name, msg_text, photo_id, sent_date, is_read, reply_to_id = msg[:9]
-                        header = f"👤 **От:** {s_name} (@{s_username})\n📅 {sent_date}\n{'✅ Прочитано' if is_read else '📌 Непрочитано'}\n"
-                    else:
-                        continue
-                else:
-                    # Для обычных
-                    if len(msg) >= 6:
-                        msg_id, msg_text, photo_id, sent_date, is_read, reply_to_id = msg[:6]
-                        header = f"📅 {sent_date}\n{'✅ Прочитано' if is_read else '📌 Непрочитано'}\n"
-                    else:
-                        continue
-                
-                content = f"{'📸 [ФОТО] ' if photo_id else '📝 '}{msg_text if msg_text else ''}"
-                preview = header + content[:100] + ('...' if len(content) > 100 else '')
-                
-                keyboard = [
-                    [InlineKeyboardButton("👁️ Прочитать", callback_data=f"read_{msg_id}"),
-                     InlineKeyboardButton("💬 Ответить", callback_data=f"reply_{msg_id}")]
-                ]
-                await query.message.reply_text(preview, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-            
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]]
-            await query.message.reply_text("Выберите действие:", reply_markup=InlineKeyboardMarkup(keyboard))
-            return
-        
-        elif query.data.startswith("read_"):
-            msg_id = int(query.data.split("_")[1])
-            db.mark_message_as_read(msg_id)
-            
-            msg = db.get_message_by_id(msg_id, requesting_user_id=user_id)
-            if msg:
-                if is_admin:
-                    if len(msg) >= 9:
-                        msg_id, sender_id, s_username, s_name, recipient_id, msg_text, photo_id, sent_date, reply_to_id = msg[:9]
-                        header = (f"👤 **Отправитель:** {s_name}\n"
-                                 f"📱 Username: @{s_username if s_username else 'Нет'}\n"
-                                 f"🆔 ID: `{sender_id}`\n"
-                                 f"📅 {sent_date}\n\n")
-                    else:
-                        await query.edit_message_text("❌ Ошибка загрузки сообщения")
-                        return
-                else:
-                    if len(msg) >= 6:
-                        msg_id, recipient_id, msg_text, photo_id, sent_date, reply_to_id = msg[:6]
-                        header = f"📅 {sent_date}\n\n"
-                    else:
-                        await query.edit_message_text("❌ Ошибка загрузки сообщения")
-                        return
-                
-                if reply_to_id:
-                    header = f"💬 **Ответ на сообщение #{reply_to_id}**\n\n{header}"
-                
-                # Отправляем фото если есть
-                if photo_id:
-                    await context.bot.send_photo(
-                        chat_id=user_id,
-                        photo=photo_id,
-                        caption=f"{header}📝 **Подпись:** {msg_text if msg_text else 'Без подписи'}",
-                        parse_mode='Markdown'
-                    )
-                    # Удаляем предыдущее сообщение
-                    await query.message.delete()
-                else:
-                    text = header + f"📝 **Сообщение:**\n{msg_text}"
-                    keyboard = [
-                        [InlineKeyboardButton("💬 Ответить", callback_data=f"reply_{msg_id}")],
-                        [InlineKeyboardButton("🔙 Назад", callback_data="my_messages")]
-                    ]
-                    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-            return
-        
-        elif query.data.startswith("reply_"):
-            msg_id = int(query.data.split("_")[1])
-            msg = db.get_message_by_id(msg_id, requesting_user_id=user_id)
-            
-            if msg:
-                if is_admin:
-                    if len(msg) >= 9:
-                        msg_id, sender_id, s_username, s_name, recipient_id, msg_text, photo_id, sent_date, reply_to_id = msg[:9]
-                    else:
-                        await query.edit_message_text("❌ Ошибка загрузки сообщения")
-                        return
-                else:
-                    if len(msg) >= 6:
-                        msg_id, recipient_id, msg_text, photo_id, sent_date, reply_to_id = msg[:6]
-                        sender_id = recipient_id
-                    else:
-                        await query.edit_message_text("❌ Ошибка загрузки сообщения")
-                        return
-                
-                context.user_data['replying_to'] = {
-                    'message_id': msg_id,
-                    'sender_id': sender_id,
-                    'original_text': msg_text,
-                    'photo_id': photo_id
-                }
-                
-                if photo_id:
-                    await query.edit_message_text(
-                        f"✏️ **Вы отвечаете на фото:**\n\n"
-                        f"Подпись: {msg_text if msg_text else 'Без подписи'}\n\n"
-                        f"Отправьте ваш ответ (текст или фото):",
-                        parse_mode='Markdown'
-                    )
-                else:
-                    await query.edit_message_text(
-                        f"✏️ **Вы отвечаете на сообщение:**\n"
-                        f"\"{msg_text[:100]}{'...' if len(msg_text) > 100 else ''}\"\n\n"
-                        f"Отправьте ваш ответ (текст или фото):",
-                        parse_mode='Markdown'
+        message_filters = parse_message_filters(context.args)
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Неверный фильтр.\n"
+            "Пример: /messages to=123 from=456 since=2024-01-01 until=2024-01-31 photo unread"
+        )
+        return
+    
+    context.user_data['admin_message_filters'] = message_filters
+    text, reply_markup = build_admin_messages_page(message_filters)
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+def build_search_page(search_query, offset=0):
+    """Формирует страницу результатов полнотекстового поиска"""
+    results, has_more = db.search_messages(search_query, limit=SEARCH_PAGE_SIZE, offset=offset)
+    text = f"🔍 **Поиск:** {search_query}\n\n"
+    
+    for msg_id, sender_id, recipient_id, sent_date, media_count, snippet in results:
+        text += (f"• **#{msg_id}** {'📸' if media_count else '📝'} {sent_date}\n"
+                f"  👤 `{sender_id}` → 👥 `{recipient_id}`\n"
+                f"  {snippet or 'Без текста'}\n\n")
+    if not results:
+        text += "Ничего не найдено\n"
+    
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=cb("adm_search", max(offset - SEARCH_PAGE_SIZE, 0))))
+    if has_more:
+        navigation.append(InlineKeyboardButton("➡️ Далее", callback_data=cb("adm_search", offset + SEARCH_PAGE_SIZE)))
+    
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton("🔙 Админ-панель", callback_data=cb("adm"))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /search - поиск по тексту сообщений для админа"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    search_query = " ".join(context.args).strip()
+    if not search_query:
+        await update.message.reply_text("🔍 Использование: /search <слова для поиска>")
+        return
+    
+    context.user_data['admin_search'] = search_query
+    text, reply_markup = build_search_page(search_query)
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+def build_thread_page(root_id, user_id, is_admin, after_id=0):
+    """Формирует страницу переписки, начиная с корневого сообщения"""
+    participant_id = None if is_admin else user_id
+    messages, next_cursor = db.get_thread(root_id, participant_id, after_id, limit=THREAD_PAGE_SIZE)
+    if not messages and after_id == 0:
+        return None, None
+    
+    text = "🧵 **Переписка:**\n\n"
+    for msg_id, sender_id, recipient_id, msg_text, media_count, sent_date, depth in messages:
+        if is_admin:
+            direction = f"👤 `{sender_id}` → `{recipient_id}`"
+        else:
+            direction = "➡️ Вы" if sender_id == user_id else "⬅️ Вам"
+        indent = "  " * min(depth, 5)
+        content = f"{'📸 ' if media_count else ''}{msg_text[:200] if msg_text else 'Без текста'}"
+        text += f"{indent}• **#{msg_id}** {direction} · {sent_date}\n{indent}  {content}\n\n"
+    
+    keyboard = []
+    if next_cursor is not None:
+        keyboard.append([InlineKeyboardButton("➡️ Далее", callback_data=cb("thread", root_id, next_cursor))])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=cb("msgs"))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /export - выгрузка пользователей и сообщений для админа"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    fmt = context.args[0].lower() if context.args else 'csv'
+    if fmt not in EXPORT_FORMATS:
+        await update.message.reply_text(f"📦 Использование: /export [{'|'.join(EXPORT_FORMATS)}]")
+        return
+    
+    await update.message.reply_text("⏳ Готовлю выгрузку...")
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            # Выгрузка читает базу в отдельном потоке, чтобы не блокировать бота
+            results = await asyncio.to_thread(export_database, database_sources(db), out_dir, fmt)
+            for path, count in results:
+                with open(path, 'rb') as f:
+                    await update.message.reply_document(
+                        f,
+                        filename=os.path.basename(path),
+                        caption=f"📦 {os.path.basename(path)}: {count} строк"
                     )
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки: {e}")
+        await update.message.reply_text("❌ Не удалось сделать выгрузку.")
+
+async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команд /ban и /unban для админа"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    command = update.message.text.split()[0].lstrip('/').split('@')[0]
+    try:
+        target_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text(f"Использование: /{command} <ID пользователя>")
+        return
+    
+    if command == "ban":
+        db.ban_user(target_id)
+        antispam.banned.add(target_id)
+        await update.message.reply_text(f"🚫 Пользователь `{target_id}` заблокирован", parse_mode='Markdown')
+    else:
+        db.unban_user(target_id)
+        antispam.banned.discard(target_id)
+        await update.message.reply_text(f"✅ Пользователь `{target_id}` разблокирован", parse_mode='Markdown')
+
+async def limits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /limits - просмотр и изменение лимитов антиспама"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    if context.args:
+        values = {'sender': antispam.sender_limit, 'pair': antispam.pair_limit, 'window': antispam.window}
+        try:
+            for arg in context.args:
+                key, _, value = arg.partition("=")
+                if key not in values or int(value) <= 0:
+                    raise ValueError(arg)
+                values[key] = int(value)
+        except ValueError:
+            await update.message.reply_text("Использование: /limits sender=20 pair=5 window=60")
             return
-        
-        elif query.data == "my_link":
-            link = db.get_user_link(user_id)
-            bot_link = f"https://t.me/{BOT_USERNAME}?start={link}"
-            unread = db.get_unread_count(user_id)
-            
-            text = f"🔗 **Ваша ссылка:**\n`{bot_link}`\n\n📊 **Непрочитанных:** {unread}"
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]]
-            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-            return
-        
-        elif query.data == "help":
-            help_text = (
-                "📚 **Как пользоваться ботом:**\n\n"
-                "1️⃣ **Получите ссылку** - нажмите /start\n"
-                "2️⃣ **Отправьте ссылку** друзьям\n"
-                "3️⃣ **Они напишут вам** анонимно (текст или фото)\n"
-                "4️⃣ **Вы получите уведомление** с кнопкой ответа\n"
-                "5️⃣ **Нажмите 'Ответить'** чтобы продолжить диалог\n\n"
-                "📸 **Поддерживаются фото с подписями!**\n\n"
-                "🔐 **Всё полностью анонимно!**"
+        antispam.configure(values['sender'], values['pair'], values['window'])
+        antispam.save(db)
+    
+    await update.message.reply_text(
+        f"🛡 **Антиспам:**\n"
+        f"От одного отправителя: {antispam.sender_limit} за {antispam.window} сек\n"
+        f"Одному получателю: {antispam.pair_limit} за {antispam.window} сек\n"
+        f"Заблокировано: {len(antispam.banned)}",
+        parse_mode='Markdown'
+    )
+
+def build_broadcast_status():
+    """Формирует отчет о последней рассылке"""
+    broadcast = db.get_latest_broadcast()
+    keyboard = []
+    if not broadcast:
+        text = "📣 **Рассылка**\n\nРассылок еще не было.\n\nЗапуск: /broadcast текст"
+    else:
+        broadcast_id, broadcast_text, status, last_user_id, delivered, blocked, failed, total, created_date = broadcast
+        status_label = {'running': '⏳ Идет', 'done': '✅ Завершена', 'cancelled': '⛔ Остановлена'}.get(status, status)
+        text = (f"📣 **Рассылка #{broadcast_id}** от {created_date}\n"
+                f"{status_label}\n\n"
+                f"📬 Доставлено: {delivered}\n"
+                f"🚫 Заблокировали бота: {blocked}\n"
+                f"❌ Ошибки: {failed}\n"
+                f"👥 Обработано: {delivered + blocked + failed} из {total}\n"
+                f"🕒 {datetime.now().strftime('%H:%M:%S')}\n\n"
+                f"📝 {broadcast_text[:200]}")
+        if status == 'running':
+            keyboard.append([InlineKeyboardButton("🔄 Обновить", callback_data=cb("adm_bc")),
+                             InlineKeyboardButton("⛔ Остановить", callback_data=cb("adm_bc_stop", broadcast_id))])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=cb("adm"))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /maintenance - обслуживание базы вне расписания"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    await update.message.reply_text("🧹 Обслуживание базы запущено...")
+    await maintenance.run(force=True)
+    await update.message.reply_text(maintenance.format_text(), parse_mode='Markdown')
+
+async def run_profile(bot, chat_id, seconds):
+    """Профилирует бота seconds секунд и присылает стеки документом"""
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    
+    top = "\n".join(f"{count} {label}" for label, count in profiler.top_functions(5))
+    filename = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    with tempfile.TemporaryDirectory() as out_dir:
+        path = os.path.join(out_dir, filename)
+        profiler.write_collapsed(path)
+        with open(path, 'rb') as f:
+            await bot.send_document(
+                chat_id, f, filename=filename,
+                caption=f"🔥 {profiler.samples} снимков за {seconds} с (flamegraph.pl / speedscope)\n\n{top}"[:1024]
             )
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]]
-            await query.edit_message_text(help_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-            return
-        
-        elif query.data == "admin_panel" and is_admin:
-            users = db.get_all_users()
-            messages = db.get_all_messages_admin(limit=100)
-            
-            text = (f"👑 **Админ-панель**\n\n"
-                    f"📊 **Статистика:**\n"
-                    f"👥 Пользователей: {len(users)}\n"
-                    f"💬 Сообщений: {len(messages)}\n")
-            
-            keyboard = [
-                [InlineKeyboardButton("👥 Все пользователи", callback_data="admin_users")],
-                [InlineKeyboardButton("📨 Все сообщения", callback_data="admin_messages")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]
-            ]
-            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-            return
-        
-        elif query.data == "admin_users" and is_admin:
-            users = db.get_all_users()
-            text = "👥 **Все пользователи:**\n\n"
-            for u in users[:15]:
-                if len(u) >= 6:
-                    uid, username, name, date, link, admin = u[:6]
-                    username_display = f"@{username}" if username else "Нет username"
-                    text += (f"• **{name}**\n"
-                            f"  📱 {username_display}\n"
-                            f"  🆔 `{uid}`\n"
-                            f"  📅 {date.split()[0] if date else 'Нет'}\n"
-                            f"  {'👑 Админ' if admin else '👤 Пользователь'}\n\n")
-            
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]]
-            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-            return
+
+async def start_profile(context, chat_id, seconds):
+    """Запускает профайлер в фоне, чтобы бот продолжал обрабатывать обновления"""
+    if profiler.running:
+        return False
+    context.application.create_task(run_profile(context.bot, chat_id, seconds))
+    return True
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile [секунд] - сэмплирующий профайлер"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_SECONDS
+    except ValueError:
+        await update.message.reply_text("🔥 Использование: /profile [секунд]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    
+    if await start_profile(context, update.effective_chat.id, seconds):
+        await update.message.reply_text(f"🔥 Профилирование запущено на {seconds} с")
+    else:
+        await update.message.reply_text("⏳ Профайлер уже запущен.")
+
+def build_memory_text(application):
+    """Текст отчета о памяти: RSS, состояние диалогов и размеры кэшей"""
+    rss = rss_bytes()
+    user_data = application.user_data
+    caches = [
+        ("Сообщения", db.message_cache),
+        ("Отправители", db.sender_profiles),
+        ("Пользователи", db.user_profiles),
+        ("Корни переписок", db.thread_roots),
+        ("Меню", menu_cache.entries),
+        ("Антиспам", antispam.per_sender.hits),
+        ("Антиспам (пары)", antispam.per_pair.hits),
+        ("Уведомления", notifier.pending),
+        ("Альбомы", albums.pending),
+    ]
+    lines = [
+        f"🧠 Память: RSS {format_size(rss) if rss is not None else 'н/д'}",
+        f"👤 user_data: {len(user_data)} шт., {format_size(deep_size(dict(user_data)))}; "
+        f"chat_data: {len(application.chat_data)} шт.",
+        f"🧹 Удалено брошенных user_data/chat_data: {janitor.evicted} (TTL {janitor.ttl} с)",
+        "",
+    ]
+    lines.extend(f"{name}: {len(cache)} шт., {format_size(deep_size(cache, skip=(Database,)))}"
+                 for name, cache in caches)
+
+    if memory_tracker.tracing and memory_tracker.snapshot is not None:
+        diff = memory_tracker.diff()
+        if diff:
+            lines.append(f"\n📈 Прирост с прошлого снимка ({memory_tracker.taken_at}):")
+            lines.extend(format_stat(stat) for stat in diff)
+        elif memory_tracker.previous is None:
+            lines.append(f"\n📸 tracemalloc включен в {memory_tracker.taken_at}, "
+                         f"следующий /memory snapshot покажет прирост")
+        else:
+            lines.append(f"\n📸 Снимок {memory_tracker.taken_at}, больше всего памяти:")
+            lines.extend(format_stat(stat) for stat in memory_tracker.top())
+    return "\n".join(lines)
+
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /memory [snapshot|sweep|stop] - учет памяти процесса"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    action = context.args[0] if context.args else ''
+    if action == 'snapshot':
+        memory_tracker.take_snapshot()
+    elif action == 'sweep':
+        janitor.sweep(context.application)
+    elif action == 'stop':
+        memory_tracker.stop()
+    elif action:
+        await update.message.reply_text("🧠 Использование: /memory [snapshot|sweep|stop]")
+        return
+    
+    # Имена файлов содержат подчеркивания, поэтому без Markdown
+    await update.message.reply_text(build_memory_text(context.application))
+
+async def run_backup():
+    """Делает резервную копию в отдельном потоке, бот продолжает писать в базу"""
+    # Шарды копируются через соединения для записи: запись через другое соединение
+    # начинала бы копирование шарда заново
+    async with backup_lock:
+        return await asyncio.to_thread(
+            create_backup, [db] + getattr(db, 'writers', []), BACKUP_DIR,
+            BACKUP_PAGES, BACKUP_PAUSE, BACKUP_KEEP
+        )
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /backup - резервная копия без остановки бота"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    if backup_lock.locked():
+        await update.message.reply_text("⏳ Резервная копия уже создается.")
+        return
+    
+    await update.message.reply_text("⏳ Создаю резервную копию...")
+    try:
+        out_dir, files, elapsed = await run_backup()
+    except Exception as e:
+        logger.error(f"Ошибка резервного копирования: {e}")
+        await update.message.reply_text("❌ Не удалось создать резервную копию.")
+        return
+    
+    lines = [f"• `{os.path.basename(path)}`: {format_size(size)}" for path, size in files]
+    await update.message.reply_text(
+        f"💾 **Копия готова** за {elapsed:.1f} с\n`{out_dir}`\n" + "\n".join(lines),
+        parse_mode='Markdown'
+    )
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /broadcast - рассылка всем пользователям"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    # Берем текст целиком, чтобы сохранить переносы строк
+    parts = update.message.text.split(None, 1)
+    if len(parts) < 2 or not parts[1].strip():
+        await update.message.reply_text("📣 Использование: /broadcast текст сообщения")
+        return
+    if broadcaster.is_running():
+        await update.message.reply_text("⏳ Предыдущая рассылка еще идет.")
+        return
+    
+    broadcaster.start(context.bot, parts[1], update.effective_user.id)
+    text, reply_markup = build_broadcast_status()
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def start_reply(request):
+    """Запоминает сообщение, на которое отвечает пользователь"""
+    msg = request.message
+    request.context.user_data['replying_to'] = {
+        'message_id': msg.id,
+        'sender_id': msg.sender_id
+    }
+    
+    msg_text = msg.text
+    if msg.media_count:
+        await request.query.edit_message_text(
+            f"✏️ **Вы отвечаете на фото:**\n\n"
+            f"Подпись: {msg_text if msg_text else 'Без подписи'}\n\n"
+            f"Отправьте ваш ответ (текст или фото):",
+            parse_mode='Markdown'
+        )
+    else:
+        await request.query.edit_message_text(
+            f"✏️ **Вы отвечаете на сообщение:**\n"
+            f"\"{msg_text[:100]}{'...' if len(msg_text) > 100 else ''}\"\n\n"
+            f"Отправьте ваш ответ (текст или фото):",
+            parse_mode='Markdown'
+        )
+
+@router.route("qr", load_message=True, legacy="quick_reply")
+async def on_quick_reply(request):
+    """Быстрый ответ из уведомления"""
+    await start_reply(request)
+
+@router.route("reply", load_message=True)
+async def on_reply(request):
+    """Ответ на сообщение из списка"""
+    await start_reply(request)
+
+@router.route("msgs", legacy="my_messages")
+async def on_my_messages(request):
+    """Список сообщений пользователя"""
+    query = request.query
+    messages = db.get_user_messages(request.user_id, requesting_user_id=request.user_id)
+    
+    if not messages:
+        await query.edit_message_text("📭 У вас нет сообщений")
+        await query.message.reply_text("Выберите действие:", reply_markup=templates.back_to_menu)
+        return
+    
+    await query.edit_message_text("📨 **Ваши сообщения:**", parse_mode='Markdown')
+    
+    for msg in messages:
+        header = f"📅 {msg.sent_date}\n{'✅ Прочитано' if msg.is_read else '📌 Непрочитано'}\n"
+        if request.is_admin:
+            header = f"👤 **От:** {msg.sender_first_name} (@{msg.sender_username})\n" + header
         
-        elif query.data == "admin_messages" and is_admin:
-            messages = db.get_all_messages_admin(limit=20)
-            text = "📨 **Последние сообщения:**\n\n"
-            
-            for m in messages[:15]:
-                if len(m) >= 11:
-                    msg_id, s_id, s_user, s_name, r_id, msg_txt, photo_id, date, is_read, r_user, r_name = m[:11]
-                    text += (f"• **#{msg_id}**\n"
-                            f"  👤 **От:** {s_name} (@{s_user})\n"
-                            f"  👥 **Кому:** {r_name}\n"
-                            f"  📅 {date}\n"
-                            f"  {'📸 Фото' if photo_id else '📝 Текст'}: {msg_txt[:50] if msg_txt else 'Без текста'}{'...' if msg_txt and len(msg_txt) > 50 else ''}\n"
-                            f"  {'✅ Прочитано' if is_read else '📌 Непрочитано'}\n\n")
-            
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]]
-            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-            return
+        content = f"{'📸 [ФОТО] ' if msg.media_count else '📝 '}{msg.text if msg.text else ''}"
+        preview = header + content[:100] + ('...' if len(content) > 100 else '')
         
-        elif query.data == "back_to_menu":
-            # Показываем главное меню
-            user = update.effective_user
-            unique_link = db.get_user_link(user_id)
-            bot_link = f"https://t.me/{BOT_USERNAME}?start={unique_link}"
-            unread_count = db.get_unread_count(user_id)
-            
-            welcome_message = (
-                f"👋 **{user.first_name}**, добро пожаловать!\n\n"
-                f"🔗 **Твоя ссылка:**\n"
-                f"`{bot_link}`\n\n"
-                f"📊 **Непрочитанных:** {unread_count}"
+        keyboard = [
+            [InlineKeyboardButton("👁️ Прочитать", callback_data=cb("read", msg.id)),
+             InlineKeyboardButton("💬 Ответить", callback_data=cb("reply", msg.id))]
+        ]
+        await query.message.reply_text(preview, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    
+    await query.message.reply_text("Выберите действие:", reply_markup=templates.back_to_menu)
+
+@router.route("read")
+async def on_read(request):
+    """Просмотр сообщения целиком"""
+    msg_id = int(request.args[0])
+    await db.mark_message_as_read_async(msg_id)
+    
+    msg = load_callback_message(msg_id, request.user_id, request.is_admin)
+    if not msg:
+        return
+    menu_cache.invalidate(request.user_id, msg.recipient_id)
+    
+    query = request.query
+    if request.is_admin:
+        header = (f"👤 **Отправитель:** {msg.sender_first_name}\n"
+                 f"📱 Username: @{msg.sender_username if msg.sender_username else 'Нет'}\n"
+                 f"🆔 ID: `{msg.sender_id}`\n"
+                 f"📅 {msg.sent_date}\n\n")
+    else:
+        header = f"📅 {msg.sent_date}\n\n"
+    
+    if msg.reply_to_id:
+        header = f"💬 **Ответ на сообщение #{msg.reply_to_id}**\n\n{header}"
+    
+    # Кнопка переписки, если сообщение входит в цепочку ответов
+    thread_button = []
+    if msg.reply_to_id or db.has_replies(msg_id):
+        thread_button = [InlineKeyboardButton("🧵 Переписка", callback_data=cb("thread", msg_id))]
+    
+    # Альбом отправляем одним запросом; кнопки переписки - отдельным сообщением
+    if msg.media_count > 1:
+        await request.context.bot.send_media_group(
+            chat_id=request.user_id,
+            media=media_group(msg.media, f"{header}📝 **Подпись:** {msg.text if msg.text else 'Без подписи'}")
+        )
+        if thread_button:
+            await request.context.bot.send_message(
+                chat_id=request.user_id, text="🧵 Сообщение входит в переписку",
+                reply_markup=InlineKeyboardMarkup([thread_button])
             )
-            
-            keyboard = [
-                [InlineKeyboardButton("📨 Мои сообщения", callback_data="my_messages")],
-                [InlineKeyboardButton("🔄 Моя ссылка", callback_data="my_link")],
-                [InlineKeyboardButton("❓ Помощь", callback_data="help")]
-            ]
-            
-            if is_admin:
-                keyboard.append([InlineKeyboardButton("👑 Админ-панель", callback_data="admin_panel")])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            try:
-                await query.edit_message_text(welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
-            except:
-                await query.message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
-            return
-            
-    except Exception as e:
-        logger.error(f"Ошибка в button_callback: {e}")
-        await query.edit_message_text("❌ Произошла ошибка. Попробуйте еще раз.")
+        await query.message.delete()
+    # Отправляем фото если есть
+    elif msg.photo_id:
+        await request.context.bot.send_photo(
+            chat_id=request.user_id,
+            photo=msg.photo_id,
+            caption=f"{header}📝 **Подпись:** {msg.text if msg.text else 'Без подписи'}",
+            reply_markup=InlineKeyboardMarkup([thread_button]) if thread_button else None,
+            parse_mode='Markdown'
+        )
+        # Удаляем предыдущее сообщение
+        await query.message.delete()
+    else:
+        text = header + f"📝 **Сообщение:**\n{msg.text}"
+        keyboard = [
+            [InlineKeyboardButton("💬 Ответить", callback_data=cb("reply", msg_id))],
+            [InlineKeyboardButton("🔙 Назад", callback_data=cb("msgs"))]
+        ]
+        if thread_button:
+            keyboard.insert(1, thread_button)
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+@router.route("thread")
+async def on_thread(request):
+    """Просмотр переписки: thread:<id сообщения> или thread:<id корня>:<id последнего на странице>"""
+    query = request.query
+    if len(request.args) == 2:
+        root_id, after_id = int(request.args[0]), int(request.args[1])
+    else:
+        root_id, after_id = db.get_thread_root(int(request.args[0])), 0
+    
+    text, reply_markup = build_thread_page(root_id, request.user_id, request.is_admin, after_id) if root_id else (None, None)
+    if not text:
+        await query.edit_message_text("❌ Переписка не найдена")
+        return
+    
+    # Сообщение с фото нельзя превратить в текст - отправляем новое
+    if query.message.photo:
+        await query.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+@router.route("link", legacy="my_link")
+async def on_my_link(request):
+    """Ссылка пользователя"""
+    user = request.update.effective_user
+    text = menu_cache.get('link', request.user_id, user.first_name, request.is_admin)
+    await request.query.edit_message_text(text, reply_markup=templates.back_to_menu, parse_mode='Markdown')
+
+@router.route("help")
+async def on_help(request):
+    """Справка"""
+    await request.query.edit_message_text(templates.help_text, reply_markup=templates.back_to_menu, parse_mode='Markdown')
+
+@router.route("adm", admin_only=True, legacy="admin_panel")
+async def on_admin_panel(request):
+    """Админ-панель"""
+    http_stats = format_pool_stats(request.context.bot_data)
+    http_stats = f"🌐 {http_stats}\n" if http_stats else ""
+    text = (f"👑 **Админ-панель**\n\n"
+            f"📊 **Статистика:**\n"
+            f"{stats_cache.format_text()}{http_stats}"
+            f"{maintenance.format_text()}\n"
+            f"{lag_monitor.format_text()}\n"
+            f"{router.format_text()}\n"
+            f"{outbox.format_text()}\n\n"
+            f"🔎 Фильтр сообщений: /messages to=ID from=ID since=ГГГГ-ММ-ДД until=ГГГГ-ММ-ДД photo unread\n"
+            f"🔍 Поиск по тексту: /search слова\n"
+            f"📦 Выгрузка: /export csv или /export jsonl\n"
+            f"🛡 Антиспам: /limits, /ban ID, /unban ID\n"
+            f"🧹 Обслуживание базы: /maintenance, резервная копия: /backup\n"
+            f"🔥 Профайлер: /profile секунд, память: /memory snapshot")
+    
+    keyboard = [
+        [InlineKeyboardButton("👥 Все пользователи", callback_data=cb("adm_users"))],
+        [InlineKeyboardButton("📨 Все сообщения", callback_data=cb("adm_msgs"))],
+        [InlineKeyboardButton("📣 Рассылка", callback_data=cb("adm_bc"))],
+        [InlineKeyboardButton(f"🔥 Профайлер {PROFILE_SECONDS} с", callback_data=cb("adm_prof"))],
+        [InlineKeyboardButton("🔙 Назад", callback_data=cb("menu"))]
+    ]
+    await request.query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+@router.route("adm_prof", admin_only=True)
+async def on_admin_profile(request):
+    """Запуск профайлера из админ-панели"""
+    if await start_profile(request.context, request.user_id, PROFILE_SECONDS):
+        await request.query.message.reply_text(f"🔥 Профилирование запущено на {PROFILE_SECONDS} с")
+    else:
+        await request.query.message.reply_text("⏳ Профайлер уже запущен.")
+
+@router.route("adm_users", admin_only=True, legacy="admin_users")
+async def on_admin_users(request):
+    """Страница пользователей: adm_users или adm_users:<user_id последнего на предыдущей странице>"""
+    after_user_id = int(request.args[0]) if request.args else None
+    text, reply_markup = build_admin_users_page(after_user_id)
+    await request.query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+@router.route("adm_msgs", admin_only=True, legacy="admin_messages")
+async def on_admin_messages(request):
+    """Страница сообщений: adm_msgs или adm_msgs:<id последнего на предыдущей странице>"""
+    before_id = int(request.args[0]) if request.args else None
+    message_filters = request.context.user_data.get('admin_message_filters', {})
+    text, reply_markup = build_admin_messages_page(message_filters, before_id)
+    await request.query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+@router.route("adm_freset", admin_only=True, legacy="admin_filters_reset")
+async def on_admin_filters_reset(request):
+    """Сброс фильтров списка сообщений"""
+    request.context.user_data.pop('admin_message_filters', None)
+    text, reply_markup = build_admin_messages_page({})
+    await request.query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+@router.route("adm_search", admin_only=True, legacy="admin_search")
+async def on_admin_search(request):
+    """Страница результатов поиска: adm_search:<смещение>"""
+    search_query = request.context.user_data.get('admin_search')
+    if not search_query:
+        await request.query.edit_message_text("🔍 Запрос устарел, повторите /search")
+        return
+    text, reply_markup = build_search_page(search_query, int(request.args[0]))
+    await request.query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+@router.route("adm_bc", admin_only=True, legacy="admin_broadcast")
+async def on_admin_broadcast(request):
+    """Состояние последней рассылки"""
+    text, reply_markup = build_broadcast_status()
+    await request.query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+@router.route("adm_bc_stop", admin_only=True, legacy="admin_broadcast_cancel")
+async def on_admin_broadcast_cancel(request):
+    """Остановка рассылки: adm_bc_stop:<id рассылки>"""
+    broadcaster.cancel(int(request.args[0]))
+    text, reply_markup = build_broadcast_status()
+    await request.query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+@router.route("menu", legacy="back_to_menu")
+async def on_back_to_menu(request):
+    """Главное меню"""
+    query = request.query
+    user = request.update.effective_user
+    welcome_message = menu_cache.get('menu', request.user_id, user.first_name, request.is_admin)
+    reply_markup = templates.menu_keyboard(request.is_admin)
+    
+    try:
+        await query.edit_message_text(welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
+    except:
+        await query.message.reply_text(welcome_message, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик нажатий на кнопки"""
+    await router.dispatch(update, context)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
@@ -520,17 +1051,136 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 
-def main():
-    """Запуск бота"""
-    application = Application.builder().token(TOKEN).build()
-    
-    # Регистрируем обработчики
+async def refresh_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически обновляет снимок статистики"""
+    try:
+        stats_cache.refresh()
+    except Exception as e:
+        logger.error(f"Не удалось обновить статистику: {e}")
+
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически переносит старые сообщения в архив"""
+    try:
+        if await retention_policy.run(db):
+            # В архив могли уйти непрочитанные - сбрасываем кэш меню
+            menu_cache.clear()
+    except Exception as e:
+        logger.error(f"Ошибка архивирования сообщений: {e}")
+
+async def maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически обслуживает базу в тихие часы"""
+    try:
+        await maintenance.run()
+    except Exception as e:
+        logger.error(f"Ошибка обслуживания базы: {e}")
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    """Резервная копия по расписанию"""
+    try:
+        out_dir, files, elapsed = await run_backup()
+        logger.info(f"Резервная копия {out_dir} создана за {elapsed:.1f} с")
+    except Exception as e:
+        logger.error(f"Ошибка резервного копирования: {e}")
+
+async def capture_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Записывает входящее обновление в файл захвата"""
+    try:
+        recorder.record(update.to_dict())
+    except Exception as e:
+        logger.error(f"Не удалось записать обновление в захват: {e}")
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмечает активность пользователя для удаления брошенных диалогов"""
+    if update.effective_user:
+        janitor.touch(update.effective_user.id, update.effective_chat.id if update.effective_chat else None)
+
+async def conversation_sweep_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически удаляет состояние диалогов неактивных пользователей"""
+    evicted = janitor.sweep(context.application)
+    if evicted:
+        logger.info(f"Удалено брошенных user_data/chat_data: {evicted}")
+
+async def start_background_tasks_job(context: ContextTypes.DEFAULT_TYPE):
+    """Запускает замер задержки цикла событий и доставку уведомлений"""
+    lag_monitor.start()
+    outbox.start(context.bot)
+
+async def stop_background_tasks(application):
+    """Останавливает фоновые задачи, запущенные мимо Application.create_task"""
+    outbox.stop()
+    lag_monitor.stop()
+
+async def resume_broadcasts_job(context: ContextTypes.DEFAULT_TYPE):
+    """Возобновляет рассылки, прерванные перезапуском"""
+    broadcaster.resume(context.bot)
+
+def register_handlers(application):
+    """Регистрирует обработчики и фоновые задачи бота"""
+    if recorder:
+        application.add_handler(TypeHandler(Update, capture_update), group=-2)
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("messages", messages_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler(["ban", "unban"], ban_command))
+    application.add_handler(CommandHandler("limits", limits_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("maintenance", maintenance_command))
+    application.add_handler(CommandHandler("backup", backup_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("memory", memory_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
     application.add_handler(CallbackQueryHandler(button_callback))
     application.add_error_handler(error_handler)
     
+    # Все обработчики пишут в лог вызовы дольше SLOW_HANDLER_THRESHOLD
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = lag_monitor.wrap(handler.callback)
+    
+    if application.job_queue:
+        application.job_queue.run_repeating(refresh_stats_job, interval=STATS_REFRESH_INTERVAL, first=0)
+        if retention_policy.enabled:
+            application.job_queue.run_repeating(retention_job, interval=RETENTION_INTERVAL, first=60)
+        application.job_queue.run_repeating(maintenance_job, interval=MAINTENANCE_INTERVAL, first=MAINTENANCE_INTERVAL)
+        if BACKUP_INTERVAL > 0:
+            application.job_queue.run_repeating(backup_job, interval=BACKUP_INTERVAL, first=BACKUP_INTERVAL)
+        application.job_queue.run_repeating(
+            conversation_sweep_job, interval=CONVERSATION_SWEEP_INTERVAL, first=CONVERSATION_SWEEP_INTERVAL
+        )
+        application.job_queue.run_once(start_background_tasks_job, when=0)
+        application.job_queue.run_once(resume_broadcasts_job, when=5)
+    else:
+        logger.warning("JobQueue недоступна, статистика обновляется по запросу")
+
+def build_application():
+    """Создает приложение с настроенными HTTP-пулами Bot API"""
+    builder, pools = application_builder(
+        TOKEN,
+        pool_size=TELEGRAM_POOL_SIZE,
+        updates_pool_size=TELEGRAM_UPDATES_POOL_SIZE,
+        timeouts={
+            'connect_timeout': TELEGRAM_CONNECT_TIMEOUT,
+            'read_timeout': TELEGRAM_READ_TIMEOUT,
+            'write_timeout': TELEGRAM_WRITE_TIMEOUT,
+            'pool_timeout': TELEGRAM_POOL_TIMEOUT,
+        },
+        media_timeout=TELEGRAM_MEDIA_TIMEOUT,
+        http_version=TELEGRAM_HTTP_VERSION
+    )
+    application = builder.post_shutdown(stop_background_tasks).build()
+    application.bot_data[POOLS_KEY] = pools
+    return application
+
+def main():
+    """Запуск бота"""
+    application = build_application()
+    
+    # Регистрируем обработчики
+    register_handlers(application)
+    
     print("=" * 40)
     print("🤖 Бот успешно запущен!")
     print(f"👑 Администраторы: {ADMIN_IDS}")
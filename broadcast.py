@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import Forbidden, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster:
+    """Рассылка сообщения всем пользователям с ограничением скорости и возобновлением"""
+
+    def __init__(self, db, rate=25, concurrency=10, chunk_size=100):
+        self.db = db
+        self.rate = rate
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.next_slot = 0.0
+        self.tasks = {}
+
+    def start(self, bot, text, admin_id):
+        """Создает рассылку и запускает ее в фоне"""
+        broadcast_id = self.db.create_broadcast(text, admin_id)
+        self.spawn(bot, broadcast_id)
+        return broadcast_id
+
+    def resume(self, bot):
+        """Продолжает рассылки, прерванные перезапуском бота"""
+        for broadcast_id in self.db.get_running_broadcast_ids():
+            if broadcast_id not in self.tasks:
+                logger.info(f"Возобновляю рассылку #{broadcast_id}")
+                self.spawn(bot, broadcast_id)
+
+    def spawn(self, bot, broadcast_id):
+        task = asyncio.create_task(self.run(bot, broadcast_id))
+        self.tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast_id, None))
+
+    def is_running(self):
+        return bool(self.tasks)
+
+    def cancel(self, broadcast_id):
+        """Останавливает рассылку; прогресс остается в базе"""
+        self.db.set_broadcast_status(broadcast_id, 'cancelled')
+        task = self.tasks.get(broadcast_id)
+        if task:
+            task.cancel()
+
+    async def throttle(self):
+        """Выдает слоты отправки не чаще rate в секунду"""
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + 1 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def deliver(self, bot, user_id, text, semaphore):
+        """Отправляет одно сообщение и возвращает итог: delivered, blocked или failed"""
+        async with semaphore:
+            for _ in range(3):
+                await self.throttle()
+                try:
+                    await bot.send_message(chat_id=user_id, text=text)
+                    return 'delivered'
+                except RetryAfter as e:
+                    # Telegram просит подождать - притормаживаем всю рассылку
+                    self.next_slot = max(self.next_slot, time.monotonic() + e.retry_after)
+                except Forbidden:
+                    return 'blocked'
+                except Exception as e:
+                    logger.error(f"Рассылка: не удалось отправить {user_id}: {e}")
+                    return 'failed'
+            return 'failed'
+
+    async def run(self, bot, broadcast_id):
+        """Проходит пользователей по порядку ID порциями, сохраняя прогресс после каждой"""
+        broadcast = self.db.get_broadcast(broadcast_id)
+        if not broadcast:
+            return
+        text, last_user_id = broadcast[1], broadcast[3]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        while True:
+            user_ids = self.db.get_user_ids_after(last_user_id, self.chunk_size)
+            if not user_ids:
+                break
+            results = await asyncio.gather(*(self.deliver(bot, user_id, text, semaphore) for user_id in user_ids))
+            last_user_id = user_ids[-1]
+            # После рестарта повторно уйдет не больше одной порции
+            self.db.update_broadcast_progress(
+                broadcast_id, last_user_id,
+                results.count('delivered'), results.count('blocked'), results.count('failed')
+            )
+
+        self.db.set_broadcast_status(broadcast_id, 'done')
+        logger.info(f"Рассылка #{broadcast_id} завершена")
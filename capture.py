@@ -0,0 +1,189 @@
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+# Ключи с персональными строками, которые заменяются псевдонимами
+NAME_KEYS = frozenset({'username', 'first_name', 'last_name', 'title', 'forward_sender_name', 'author_signature'})
+TEXT_KEYS = frozenset({'text', 'caption'})
+FILE_KEYS = frozenset({'file_id', 'file_unique_id'})
+# Телефоны, ссылки entities и адреса: псевдо-слова той же формы (цифры - цифрами)
+WORD_KEYS = frozenset({'phone_number', 'url', 'address', 'bio', 'description'})
+# id пользователя вне объектов User/Chat, например contact.user_id
+USER_ID_KEYS = frozenset({'user_id'})
+# Координаты обнуляются, визитка удаляется целиком
+COORDINATE_KEYS = frozenset({'latitude', 'longitude'})
+DROP_KEYS = frozenset({'vcard'})
+
+# Ссылка /start в захвате: владелец ссылки вместо самой ссылки
+START_TARGET_PREFIX = "@"
+
+# Буквенные и цифровые куски текста заменяются по отдельности
+WORD = re.compile(r"\d+|[^\W\d]+")
+
+# Аргументы команд (ключ до "=", "" - позиционный), в которых id пользователя:
+# они заменяются тем же псевдонимом, что и сам пользователь, чтобы повтор их находил
+USER_ID_ARGS = {'/ban': {''}, '/unban': {''}, '/messages': {'to', 'from'}}
+# Аргументы, без которых команда не работает (числа, даты, ключевые слова); персональных
+# данных в них нет. Сравнивается ключ до "=" или весь аргумент; "" - любой позиционный
+KEEP_ARGS = {
+    '/profile': {''},
+    '/limits': {'sender', 'pair', 'window'},
+    '/messages': {'since', 'until', 'photo', 'nophoto', 'unread', 'read'},
+    '/export': {'csv', 'jsonl'},
+    '/memory': {'snapshot', 'sweep', 'stop'},
+}
+
+
+class Anonymizer:
+    """Заменяет id, имена, тексты, телефоны, ссылки и file_id обновления стабильными псевдонимами.
+
+    Один и тот же исходный id или слово в пределах захвата всегда дает
+    один и тот же псевдоним, поэтому сохраняются форма трафика (кто кому
+    пишет, длины текстов, повторы слов для поиска, повторы фото).
+    Команды и callback_data остаются как есть: в callback_data - id
+    сообщений, по ним повтор попадает в те же строки базы. Числа в тексте
+    заменяются такими же по длине, кроме аргументов команд из KEEP_ARGS.
+    Координаты обнуляются, визитки (vcard) не сохраняются.
+    """
+
+    def __init__(self, salt, resolve_link=None):
+        self.salt = salt
+        self.resolve_link = resolve_link
+
+    def _digest(self, value):
+        return hmac.new(self.salt, str(value).encode(), hashlib.sha256).hexdigest()
+
+    def user_id(self, user_id):
+        """Псевдоним id: положительное число того же порядка, что id Telegram"""
+        return int(self._digest(user_id)[:12], 16) % 10 ** 10 + 1
+
+    def word(self, word):
+        """Псевдо-слово той же длины; цифры (телефоны, карты, id) заменяются цифрами"""
+        digest = (self._digest(word) * (len(word) // 64 + 1))[:len(word)]
+        if word.isdigit():
+            return "".join(str(int(c, 16) % 10) for c in digest)
+        return "".join(chr(ord('a') + int(c, 16) % 26) for c in digest)
+
+    def words(self, text):
+        return WORD.sub(lambda match: self.word(match.group()), text)
+
+    def argument(self, command, arg):
+        """Аргумент команды: id пользователей - псевдонимы, нужные команде числа - как есть"""
+        if command not in USER_ID_ARGS and command not in KEEP_ARGS:
+            return self.words(arg)
+        key, sep, value = arg.partition("=")
+        if not sep:
+            key, value = "", arg
+        keep = KEEP_ARGS.get(command, ())
+        if key.lower() in USER_ID_ARGS.get(command, ()) and value.isdigit():
+            return f"{key}{sep}{self.user_id(int(value))}"
+        if key.lower() in keep or (not sep and arg.lower() in keep):
+            return arg
+        return self.words(arg)
+
+    def text(self, text):
+        """Текст: команда сохраняется, слова заменяются псевдо-словами той же длины"""
+        command, _, rest = text.partition(" ") if text.startswith("/") else ("", "", text)
+        if command.split("@", 1)[0] == "/start" and rest and self.resolve_link:
+            owner_id = self.resolve_link(rest.strip())
+            if owner_id is not None:
+                return f"{command} {START_TARGET_PREFIX}{self.user_id(owner_id)}"
+        name = command.split("@", 1)[0].lower()
+        rest = re.sub(r"\S+", lambda match: self.argument(name, match.group()), rest)
+        return f"{command} {rest}" if command and rest else command or rest
+
+    def update(self, data):
+        """Анонимизирует словарь обновления (Update.to_dict()) на месте"""
+        if isinstance(data, list):
+            for item in data:
+                self.update(item)
+            return data
+        if not isinstance(data, dict):
+            return data
+
+        # Пользователь или чат: у них есть id и имя либо тип
+        if 'id' in data and ('first_name' in data or 'type' in data or 'is_bot' in data):
+            data['id'] = self.user_id(data['id'])
+        for key in DROP_KEYS.intersection(data):
+            del data[key]
+        for key, value in data.items():
+            if key in USER_ID_KEYS and isinstance(value, int):
+                data[key] = self.user_id(value)
+            elif key in COORDINATE_KEYS and isinstance(value, (int, float)):
+                data[key] = 0.0
+            elif key in WORD_KEYS and isinstance(value, str):
+                data[key] = self.words(value)
+            elif key in NAME_KEYS and isinstance(value, str):
+                data[key] = f"user{self._digest(value)[:8]}"
+            elif key in TEXT_KEYS and isinstance(value, str):
+                data[key] = self.text(value)
+            elif key in FILE_KEYS and isinstance(value, str):
+                data[key] = self._digest(value)[:len(value)]
+            elif isinstance(value, (dict, list)):
+                self.update(value)
+        return data
+
+
+class UpdateRecorder:
+    """Пишет входящие обновления в JSONL для повтора через replay.py.
+
+    Первая строка файла - заголовок с псевдонимами админов, дальше по
+    строке на обновление: {"t": секунд от начала захвата, "update": {...}}.
+    """
+
+    def __init__(self, path, admin_ids=(), salt=None, resolve_link=None):
+        self.path = path
+        self.anonymizer = Anonymizer(salt or os.urandom(16), resolve_link)
+        self.started = time.monotonic()
+        self.count = 0
+        # Вебхук вызывает запись из потока Flask
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+        self._write({
+            'header': True,
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'admins': [self.anonymizer.user_id(admin_id) for admin_id in admin_ids],
+        })
+
+    def _write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def record(self, update_data):
+        """Анонимизирует и записывает словарь обновления"""
+        self._write({
+            't': round(time.monotonic() - self.started, 3),
+            'update': self.anonymizer.update(update_data),
+        })
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_capture(path):
+    """Читает захват: (псевдонимы админов, [(t, обновление)])"""
+    admins = []
+    updates = []
+    offset = 0.0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get('header'):
+                # Файл дописывается несколькими запусками: время каждого считается от его заголовка
+                admins.extend(record['admins'])
+                offset = updates[-1][0] if updates else 0.0
+            else:
+                updates.append((offset + record['t'], record['update']))
+    return admins, updates
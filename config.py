@@ -1,3 +1,115 @@
-TOKEN = "8362843318:AAEohEY2k8VuY0lnJX8XrmL1vRzgsR0dfvo"
+import os
+
+TOKEN = os.environ.get('TELEGRAM_TOKEN', "8362843318:AAEohEY2k8VuY0lnJX8XrmL1vRzgsR0dfvo")
+
+# ID администраторов (можно переопределить переменной окружения ADMIN_IDS=1,2,3)
 ADMIN_IDS = [8415232008]
-BOT_USERNAME = "anonim159_bot"
\ No newline at end of file
+try:
+    admin_ids_str = os.environ.get('ADMIN_IDS', '')
+    if admin_ids_str:
+        ADMIN_IDS = [int(id.strip()) for id in admin_ids_str.split(',') if id.strip()]
+except ValueError:
+    pass
+
+BOT_USERNAME = os.environ.get('BOT_USERNAME', "anonim159_bot")
+
+# Как часто (в секундах) обновлять снимок статистики админ-панели
+STATS_REFRESH_INTERVAL = int(os.environ.get('STATS_REFRESH_INTERVAL', 60))
+
+# Размер страницы в админ-браузерах пользователей и сообщений
+ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', 15))
+
+# Количество результатов на странице поиска /search
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 10))
+
+# Количество сообщений на странице просмотра переписки
+THREAD_PAGE_SIZE = int(os.environ.get('THREAD_PAGE_SIZE', 20))
+
+# Архивирование старых сообщений, по умолчанию выключено. Архив читают только
+# открытие сообщения по id и /export: из «Мои сообщения», переписок и поиска
+# перенесенные сообщения пропадают, поэтому RETENTION_DAYS включается осознанно
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 0))
+RETENTION_INCLUDE_UNREAD = os.environ.get('RETENTION_INCLUDE_UNREAD', '0') == '1'
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))
+ARCHIVE_DB_PATH = os.environ.get('ARCHIVE_DB_PATH', '')
+ARCHIVE_COMPRESS = os.environ.get('ARCHIVE_COMPRESS', '1') == '1'
+
+# Объединение уведомлений: окно (сек) и минимальный интервал между правками
+NOTIFY_COALESCE_WINDOW = int(os.environ.get('NOTIFY_COALESCE_WINDOW', 60))
+NOTIFY_EDIT_INTERVAL = int(os.environ.get('NOTIFY_EDIT_INTERVAL', 5))
+
+# Антиспам по умолчанию: сообщений от одного отправителя и одному получателю за окно (сек).
+# Админ может изменить лимиты командой /limits, они сохраняются в базе
+ANTISPAM_SENDER_LIMIT = int(os.environ.get('ANTISPAM_SENDER_LIMIT', 20))
+ANTISPAM_PAIR_LIMIT = int(os.environ.get('ANTISPAM_PAIR_LIMIT', 5))
+ANTISPAM_WINDOW = int(os.environ.get('ANTISPAM_WINDOW', 60))
+
+# Рассылка: сообщений в секунду (лимит Telegram ~30), параллельных отправок и размер порции
+BROADCAST_RATE = int(os.environ.get('BROADCAST_RATE', 25))
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 10))
+BROADCAST_CHUNK_SIZE = int(os.environ.get('BROADCAST_CHUNK_SIZE', 100))
+
+# Окно (сек), за которое фото одного альбома собираются в одно сообщение
+ALBUM_WINDOW = float(os.environ.get('ALBUM_WINDOW', 1.0))
+
+# Шардирование сообщений по получателю на N файлов (0 или 1 - одна база).
+# Выбирается при создании базы: уже сохраненные сообщения не переносятся
+DB_SHARDS = int(os.environ.get('DB_SHARDS', 0))
+
+# HTTP-клиент Bot API: размер пула исходящих вызовов и getUpdates, таймауты (сек).
+# HTTP/2 (TELEGRAM_HTTP_VERSION=2) требует пакета httpx[http2]
+TELEGRAM_POOL_SIZE = int(os.environ.get('TELEGRAM_POOL_SIZE', 100))
+TELEGRAM_UPDATES_POOL_SIZE = int(os.environ.get('TELEGRAM_UPDATES_POOL_SIZE', 1))
+TELEGRAM_HTTP_VERSION = os.environ.get('TELEGRAM_HTTP_VERSION', '1.1')
+TELEGRAM_CONNECT_TIMEOUT = float(os.environ.get('TELEGRAM_CONNECT_TIMEOUT', 5))
+TELEGRAM_READ_TIMEOUT = float(os.environ.get('TELEGRAM_READ_TIMEOUT', 10))
+TELEGRAM_WRITE_TIMEOUT = float(os.environ.get('TELEGRAM_WRITE_TIMEOUT', 10))
+TELEGRAM_POOL_TIMEOUT = float(os.environ.get('TELEGRAM_POOL_TIMEOUT', 5))
+TELEGRAM_MEDIA_TIMEOUT = float(os.environ.get('TELEGRAM_MEDIA_TIMEOUT', 60))
+
+# Обслуживание базы (ANALYZE, optimize, checkpoint, incremental_vacuum):
+# проверка раз в MAINTENANCE_INTERVAL сек, полный цикл раз в сутки в тихие часы
+MAINTENANCE_INTERVAL = int(os.environ.get('MAINTENANCE_INTERVAL', 600))
+MAINTENANCE_WINDOW = os.environ.get('MAINTENANCE_WINDOW', '3-6')
+MAINTENANCE_VACUUM_STEP = int(os.environ.get('MAINTENANCE_VACUUM_STEP', 200))
+
+# Резервные копии: каталог, период (сек, 0 - только по команде /backup), сколько хранить,
+# страниц за шаг backup API и пауза между шагами (сек), чтобы запись не ждала
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_INTERVAL = int(os.environ.get('BACKUP_INTERVAL', 86400))
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', 100))
+BACKUP_PAUSE = float(os.environ.get('BACKUP_PAUSE', 0.01))
+
+# Сэмплирующий профайлер для админа: интервал снимков (сек), длительность по умолчанию и максимум
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_SECONDS = int(os.environ.get('PROFILE_SECONDS', 30))
+PROFILE_MAX_SECONDS = int(os.environ.get('PROFILE_MAX_SECONDS', 300))
+
+# Память: состояние диалогов неактивных пользователей удаляется через CONVERSATION_TTL секунд,
+# проверка раз в CONVERSATION_SWEEP_INTERVAL; глубина стека tracemalloc для /memory
+CONVERSATION_TTL = int(os.environ.get('CONVERSATION_TTL', 21600))
+CONVERSATION_SWEEP_INTERVAL = int(os.environ.get('CONVERSATION_SWEEP_INTERVAL', 600))
+TRACEMALLOC_FRAMES = int(os.environ.get('TRACEMALLOC_FRAMES', 1))
+
+# Монитор цикла событий: период замера задержки, порог зависания и медленного обработчика (сек);
+# /health отвечает 503, если цикл не отвечает дольше HEALTH_MAX_STALL секунд
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', 0.1))
+LOOP_STALL_THRESHOLD = float(os.environ.get('LOOP_STALL_THRESHOLD', 0.5))
+SLOW_HANDLER_THRESHOLD = float(os.environ.get('SLOW_HANDLER_THRESHOLD', 1.0))
+HEALTH_MAX_STALL = float(os.environ.get('HEALTH_MAX_STALL', 5.0))
+
+# Захват входящих обновлений (анонимизированных) в JSONL для replay.py; пусто - выключено.
+# CAPTURE_SALT делает псевдонимы стабильными между запусками (по умолчанию случайная соль)
+CAPTURE_PATH = os.environ.get('CAPTURE_PATH', '')
+CAPTURE_SALT = os.environ.get('CAPTURE_SALT', '')
+
+# Outbox уведомлений: размер порции, число попыток, пауза между попытками (растет вдвое от
+# OUTBOX_BASE_DELAY до OUTBOX_MAX_DELAY сек), опрос очереди и срок хранения завершенных строк (дней)
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_BASE_DELAY = float(os.environ.get('OUTBOX_BASE_DELAY', 2))
+OUTBOX_MAX_DELAY = float(os.environ.get('OUTBOX_MAX_DELAY', 600))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))
+OUTBOX_KEEP_DAYS = int(os.environ.get('OUTBOX_KEEP_DAYS', 7))
@@ -1,12 +1,53 @@
+import os
 import sqlite3
 import string
 import random
+import time
+import zlib
+from collections import OrderedDict
 from datetime import datetime
+from records import MessageRecord, MESSAGE_COLUMNS, SENDER_COLUMNS, SENDER_JOIN
 
 class Database:
-    def __init__(self, db_name='bot_database.db'):
+    def __init__(self, db_name='bot_database.db', thread_root_cache_size=10000, archive_path=None,
+                 user_cache_size=10000, message_cache_size=1000):
+        self.db_name = db_name
         self.conn = sqlite3.connect(db_name, check_same_thread=False)
         self.cursor = self.conn.cursor()
+        
+        # Свободные страницы возвращаются порциями при обслуживании (действует для новой базы)
+        self.cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        
+        # WAL позволяет читать снимок базы (выгрузки, отчеты) параллельно с записью
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        
+        # Архив старых сообщений: отдельный файл или таблица в основной базе
+        self.archive_path = archive_path
+        if archive_path:
+            self.cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            self.archive_table = "archive.messages_archive"
+        else:
+            self.archive_table = "messages_archive"
+        self.conn.create_function("compress_text", 1, compress_text, deterministic=True)
+        
+        # Кэш "сообщение -> корень переписки"; корень сообщения никогда не меняется
+        self.thread_roots = OrderedDict()
+        self.thread_root_cache_size = thread_root_cache_size
+        
+        # Последний сохраненный профиль отправителя, чтобы не писать его на каждое сообщение
+        self.sender_profiles = OrderedDict()
+        self.sender_profile_cache_size = thread_root_cache_size
+        
+        # Профили пользователей: повторный /start известного пользователя не обращается к базе
+        self.user_profiles = OrderedDict()
+        self.user_cache_size = user_cache_size
+        
+        # Недавно открытые сообщения для нажатий "прочитать"/"ответить"
+        self.message_cache = OrderedDict()
+        self.message_cache_size = message_cache_size
+        self.message_cache_hits = 0
+        self.message_cache_misses = 0
+        
         self.create_tables()
     
     def create_tables(self):
@@ -29,42 +70,350 @@ class Database:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 recipient_id INTEGER,
                 sender_id INTEGER,
-                sender_username TEXT,
-                sender_first_name TEXT,
                 message_text TEXT,
-                photo_file_id TEXT,
+                media_count INTEGER DEFAULT 0,
                 sent_date TEXT,
                 is_read INTEGER DEFAULT 0,
                 reply_to_message_id INTEGER DEFAULT NULL
             )
         ''')
+        
+        # Профили отправителей; сообщения ссылаются на них по sender_id
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS senders (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                updated_date TEXT
+            )
+        ''')
+        
+        # Индекс для подсчета активных отправителей за день
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_sent_date
+            ON messages (sent_date, sender_id)
+        ''')
+        
+        # Индексы для постраничных выборок админ-панели
+        self.cursor.executescript('''
+            CREATE INDEX IF NOT EXISTS idx_users_join_date ON users (join_date, user_id);
+            CREATE INDEX IF NOT EXISTS idx_messages_recipient ON messages (recipient_id, id);
+            CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender_id, id);
+            CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages (id) WHERE is_read = 0;
+        ''')
+        
+        # Индекс для обхода переписки от корня к ответам
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_reply_to
+            ON messages (reply_to_message_id) WHERE reply_to_message_id IS NOT NULL
+        ''')
+        
+        # Настройки, которые админ меняет из бота
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        
+        # Заблокированные отправители
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS banned_users (
+                user_id INTEGER PRIMARY KEY,
+                banned_date TEXT
+            )
+        ''')
+        
+        # Рассылки админа с прогрессом для возобновления после рестарта
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT,
+                status TEXT DEFAULT 'running',
+                last_user_id INTEGER DEFAULT 0,
+                delivered INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                created_by INTEGER,
+                created_date TEXT
+            )
+        ''')
+        
+        # Уведомления получателям: пишутся в одной транзакции с сообщением,
+        # доставляет их фоновая задача с повторами
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id INTEGER,
+                recipient_id INTEGER,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                next_attempt REAL,
+                created_date TEXT,
+                last_error TEXT
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (next_attempt) WHERE status = 'pending'
+        ''')
+        
+        self.create_archive()
+        self.migrate_sender_columns()
+        self.create_media()
+        self.create_stats_counters()
+        self.create_search_index()
         self.conn.commit()
     
+    def create_archive(self):
+        """Создает таблицу архива для старых сообщений"""
+        # message_text без типа: в архиве там может лежать сжатый BLOB
+        self.cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.archive_table} (
+                id INTEGER PRIMARY KEY,
+                recipient_id INTEGER,
+                sender_id INTEGER,
+                message_text,
+                media_count INTEGER DEFAULT 0,
+                sent_date TEXT,
+                is_read INTEGER DEFAULT 0,
+                reply_to_message_id INTEGER DEFAULT NULL,
+                archived_date TEXT
+            )
+        ''')
+    
+    def migrate_sender_columns(self):
+        """Переносит имена отправителей из строк сообщений в таблицу senders"""
+        for table in ("messages", self.archive_table):
+            schema, _, name = table.rpartition(".")
+            prefix = f"{schema}." if schema else ""
+            self.cursor.execute(f"PRAGMA {prefix}table_info({name})")
+            if not any(column[1] == 'sender_username' for column in self.cursor.fetchall()):
+                continue
+            
+            # Берем имя из самого нового сообщения каждого отправителя
+            self.cursor.execute(f'''
+                INSERT INTO senders (user_id, username, first_name, updated_date)
+                SELECT sender_id, sender_username, sender_first_name, MAX(sent_date)
+                FROM {table}
+                GROUP BY sender_id
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    updated_date = excluded.updated_date
+                WHERE excluded.updated_date > senders.updated_date
+            ''')
+            self.cursor.execute(f"ALTER TABLE {table} DROP COLUMN sender_username")
+            self.cursor.execute(f"ALTER TABLE {table} DROP COLUMN sender_first_name")
+    
+    def create_media(self):
+        """Создает таблицы фото: каждый файл хранится один раз, сообщения ссылаются на него"""
+        self.cursor.executescript('''
+            CREATE TABLE IF NOT EXISTS media (
+                id INTEGER PRIMARY KEY,
+                file_unique_id TEXT UNIQUE,
+                file_id TEXT
+            );
+            
+            CREATE TABLE IF NOT EXISTS message_media (
+                message_id INTEGER,
+                position INTEGER,
+                media_id INTEGER,
+                PRIMARY KEY (message_id, position)
+            ) WITHOUT ROWID;
+        ''')
+        
+        # Старые базы хранили file_id прямо в строке сообщения
+        for table in ("messages", self.archive_table):
+            schema, _, name = table.rpartition(".")
+            prefix = f"{schema}." if schema else ""
+            self.cursor.execute(f"PRAGMA {prefix}table_info({name})")
+            if not any(column[1] == 'photo_file_id' for column in self.cursor.fetchall()):
+                continue
+            
+            # file_unique_id у старых фото неизвестен, ключом служит сам file_id
+            self.cursor.execute(f'''
+                INSERT INTO media (file_unique_id, file_id)
+                SELECT DISTINCT photo_file_id, photo_file_id FROM {table}
+                WHERE photo_file_id IS NOT NULL
+                ON CONFLICT(file_unique_id) DO NOTHING
+            ''')
+            self.cursor.execute(f'''
+                INSERT OR IGNORE INTO message_media (message_id, position, media_id)
+                SELECT t.id, 0, media.id FROM {table} t
+                JOIN media ON media.file_unique_id = t.photo_file_id
+            ''')
+            self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN media_count INTEGER DEFAULT 0")
+            self.cursor.execute(f"UPDATE {table} SET media_count = 1 WHERE photo_file_id IS NOT NULL")
+            
+            # Триггеры статистики и индекс ссылаются на старую колонку и создаются заново
+            if table == "messages":
+                self.cursor.executescript('''
+                    DROP TRIGGER IF EXISTS stats_messages_insert;
+                    DROP TRIGGER IF EXISTS stats_messages_delete;
+                    DROP INDEX IF EXISTS idx_messages_photo;
+                ''')
+            self.cursor.execute(f"ALTER TABLE {table} DROP COLUMN photo_file_id")
+        
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_media ON messages (id) WHERE media_count > 0
+        ''')
+    
+    def create_stats_counters(self):
+        """Создает таблицу счетчиков статистики и триггеры для ее обновления"""
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # Триггеры поддерживают счетчики при каждой записи, поэтому
+        # чтение статистики не требует обхода таблиц
+        self.cursor.executescript('''
+            CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+            BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE name = 'users';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users
+            BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS stats_messages_insert AFTER INSERT ON messages
+            BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE name = 'messages';
+                UPDATE stats_counters SET value = value + (NEW.is_read = 0) WHERE name = 'unread';
+                UPDATE stats_counters SET value = value + (NEW.media_count > 0) WHERE name = 'photos';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS stats_messages_read AFTER UPDATE OF is_read ON messages
+            BEGIN
+                UPDATE stats_counters SET value = value + (NEW.is_read = 0) - (OLD.is_read = 0)
+                WHERE name = 'unread';
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS stats_messages_delete AFTER DELETE ON messages
+            BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = 'messages';
+                UPDATE stats_counters SET value = value - (OLD.is_read = 0) WHERE name = 'unread';
+                UPDATE stats_counters SET value = value - (OLD.media_count > 0) WHERE name = 'photos';
+            END;
+        ''')
+        
+        # Первичное заполнение для уже существующей базы
+        self.cursor.execute("SELECT COUNT(*) FROM stats_counters")
+        if self.cursor.fetchone()[0] == 0:
+            self.recount_stats()
+        
+        # Счетчик архива появился позже остальных
+        self.cursor.execute(f'''
+            INSERT OR IGNORE INTO stats_counters (name, value)
+            SELECT 'archived', COUNT(*) FROM {self.archive_table}
+        ''')
+    
+    def recount_stats(self):
+        """Пересчитывает счетчики статистики агрегатными запросами"""
+        self.cursor.execute(f'''
+            INSERT OR REPLACE INTO stats_counters (name, value)
+            SELECT 'users', COUNT(*) FROM users
+            UNION ALL
+            SELECT 'messages', COUNT(*) FROM messages
+            UNION ALL
+            SELECT 'unread', COUNT(*) FROM messages WHERE is_read = 0
+            UNION ALL
+            SELECT 'photos', COUNT(*) FROM messages WHERE media_count > 0
+            UNION ALL
+            SELECT 'archived', COUNT(*) FROM {self.archive_table}
+        ''')
+        self.conn.commit()
+    
+    def create_search_index(self):
+        """Создает полнотекстовый индекс FTS5 по тексту сообщений"""
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+        exists = self.cursor.fetchone() is not None
+        
+        try:
+            # External-content таблица: текст хранится только в messages,
+            # в индексе лежат лишь токены
+            self.cursor.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    message_text,
+                    content='messages',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                
+                CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+                BEGIN
+                    INSERT INTO messages_fts (rowid, message_text) VALUES (NEW.id, NEW.message_text);
+                END;
+                
+                CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+                BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, message_text)
+                    VALUES ('delete', OLD.id, OLD.message_text);
+                END;
+                
+                CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text ON messages
+                BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, message_text)
+                    VALUES ('delete', OLD.id, OLD.message_text);
+                    INSERT INTO messages_fts (rowid, message_text) VALUES (NEW.id, NEW.message_text);
+                END;
+            ''')
+        except sqlite3.OperationalError:
+            # SQLite собран без FTS5 - поиск будет работать через LIKE
+            self.fts_enabled = False
+            return
+        
+        self.fts_enabled = True
+        if not exists:
+            # Индексируем сообщения, сохраненные до появления индекса
+            self.cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    
     def generate_unique_link(self, length=8):
-        """Генерирует уникальную ссылку для пользователя"""
+        """Генерирует случайную ссылку; уникальность проверяет индекс при вставке"""
         chars = string.ascii_letters + string.digits
-        while True:
-            link = ''.join(random.choice(chars) for _ in range(length))
-            self.cursor.execute("SELECT unique_link FROM users WHERE unique_link = ?", (link,))
-            if not self.cursor.fetchone():
-                return link
+        return ''.join(random.choice(chars) for _ in range(length))
     
-    def add_user(self, user_id, username, first_name):
-        """Добавляет нового пользователя в базу данных"""
-        self.cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-        existing = self.cursor.fetchone()
-        
-        if existing:
-            return self.get_user_link(user_id)
+    def cache_user_profile(self, user_id, profile):
+        """Запоминает профиль (username, first_name, unique_link, is_admin)"""
+        self.user_profiles[user_id] = profile
+        self.user_profiles.move_to_end(user_id)
+        if len(self.user_profiles) > self.user_cache_size:
+            self.user_profiles.popitem(last=False)
+    
+    def add_user(self, user_id, username, first_name, is_admin=False):
+        """Регистрирует пользователя или обновляет его имя, возвращает ссылку"""
+        profile = self.user_profiles.get(user_id)
+        if profile and profile[:2] == (username, first_name) and profile[3] >= is_admin:
+            self.user_profiles.move_to_end(user_id)
+            return profile[2]
         
-        unique_link = self.generate_unique_link()
         join_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        self.cursor.execute('''
-            INSERT INTO users (user_id, username, first_name, join_date, unique_link, is_admin)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, first_name, join_date, unique_link, 0))
+        while True:
+            try:
+                # Один запрос и для нового, и для известного пользователя;
+                # права админа только добавляются, но не снимаются
+                self.cursor.execute('''
+                    INSERT INTO users (user_id, username, first_name, join_date, unique_link, is_admin)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name,
+                        is_admin = MAX(users.is_admin, excluded.is_admin)
+                    RETURNING unique_link, is_admin
+                ''', (user_id, username, first_name, join_date, self.generate_unique_link(), int(is_admin)))
+                unique_link, admin_flag = self.cursor.fetchone()
+                break
+            except sqlite3.IntegrityError:
+                # Совпала случайная ссылка другого пользователя - пробуем новую
+                self.conn.rollback()
         self.conn.commit()
+        
+        self.cache_user_profile(user_id, (username, first_name, unique_link, admin_flag == 1))
         return unique_link
     
     def set_admin(self, user_id):
@@ -73,10 +422,14 @@ class Database:
             UPDATE users SET is_admin = 1 WHERE user_id = ?
         ''', (user_id,))
         self.conn.commit()
+        self.user_profiles.pop(user_id, None)
         return self.cursor.rowcount > 0
     
     def is_admin(self, user_id):
         """Проверяет, является ли пользователь администратором"""
+        profile = self.user_profiles.get(user_id)
+        if profile:
+            return profile[3]
         self.cursor.execute('''
             SELECT is_admin FROM users WHERE user_id = ?
         ''', (user_id,))
@@ -85,6 +438,9 @@ class Database:
     
     def get_user_link(self, user_id):
         """Получает уникальную ссылку пользователя"""
+        profile = self.user_profiles.get(user_id)
+        if profile:
+            return profile[2]
         self.cursor.execute("SELECT unique_link FROM users WHERE user_id = ?", (user_id,))
         result = self.cursor.fetchone()
         return result[0] if result else None
@@ -96,41 +452,104 @@ class Database:
         return result[0] if result else None
     
     def save_anonymous_message(self, recipient_id, sender_id, sender_username, sender_first_name, 
-                               message_text=None, photo_file_id=None, reply_to_id=None):
-        """Сохраняет анонимное сообщение"""
+                               message_text=None, media=None, reply_to_id=None, message_id=None, notify=False):
+        """Сохраняет анонимное сообщение; media - список (file_id, file_unique_id) фото или альбома.
+
+        message_id задается только при шардировании, иначе id выдает AUTOINCREMENT.
+        notify - поставить уведомление получателю в outbox в той же транзакции.
+        """
+        media = media or []
         sent_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.save_sender_profile(sender_id, sender_username, sender_first_name, sent_date)
         self.cursor.execute('''
             INSERT INTO messages (
-                recipient_id, sender_id, sender_username, sender_first_name, 
-                message_text, photo_file_id, sent_date, reply_to_message_id
+                id, recipient_id, sender_id, message_text, media_count, sent_date, reply_to_message_id
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (recipient_id, sender_id, sender_username, sender_first_name, 
-              message_text, photo_file_id, sent_date, reply_to_id))
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (message_id, recipient_id, sender_id, message_text, len(media), sent_date, reply_to_id))
+        message_id = self.cursor.lastrowid
+        
+        for position, media_id in enumerate(self.save_media(media)):
+            self.cursor.execute('''
+                INSERT INTO message_media (message_id, position, media_id) VALUES (?, ?, ?)
+            ''', (message_id, position, media_id))
+        if notify:
+            self.cursor.execute('''
+                INSERT INTO outbox (message_id, recipient_id, next_attempt, created_date) VALUES (?, ?, ?, ?)
+            ''', (message_id, recipient_id, time.time(), sent_date))
         self.conn.commit()
-        return self.cursor.lastrowid
+        
+        # Корень ответа совпадает с корнем исходного сообщения
+        if reply_to_id is not None and reply_to_id in self.thread_roots:
+            self.cache_thread_root(message_id, self.thread_roots[reply_to_id])
+        return message_id
+    
+    async def save_anonymous_message_async(self, *args, **kwargs):
+        """save_anonymous_message для обработчиков; в одном файле запись идет прямо в цикле событий"""
+        return self.save_anonymous_message(*args, **kwargs)
+    
+    def save_media(self, media):
+        """Находит или добавляет файлы в таблицу media, возвращает их id (без commit)"""
+        media_ids = []
+        for file_id, file_unique_id in media:
+            # Повторно пересланное фото получает ту же строку; file_id обновляем на свежий
+            self.cursor.execute('''
+                INSERT INTO media (file_unique_id, file_id) VALUES (?, ?)
+                ON CONFLICT(file_unique_id) DO UPDATE SET file_id = excluded.file_id
+                RETURNING id
+            ''', (file_unique_id or file_id, file_id))
+            media_ids.append(self.cursor.fetchone()[0])
+        return media_ids
+    
+    def get_message_media(self, message_id):
+        """Получает file_id фото сообщения в порядке альбома"""
+        self.cursor.execute('''
+            SELECT media.file_id FROM message_media
+            JOIN media ON media.id = message_media.media_id
+            WHERE message_media.message_id = ?
+            ORDER BY message_media.position
+        ''', (message_id,))
+        return [row[0] for row in self.cursor.fetchall()]
+    
+    def save_sender_profile(self, user_id, username, first_name, updated_date):
+        """Обновляет профиль отправителя, только если имя изменилось (без commit)"""
+        profile = (username, first_name)
+        if self.sender_profiles.get(user_id) == profile:
+            self.sender_profiles.move_to_end(user_id)
+            return
+        
+        self.cursor.execute('''
+            INSERT INTO senders (user_id, username, first_name, updated_date)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                updated_date = excluded.updated_date
+            WHERE senders.username IS NOT excluded.username
+               OR senders.first_name IS NOT excluded.first_name
+        ''', (user_id, username, first_name, updated_date))
+        self.sender_profiles[user_id] = profile
+        if len(self.sender_profiles) > self.sender_profile_cache_size:
+            self.sender_profiles.popitem(last=False)
+    
+    def get_sender_profile(self, sender_id):
+        """Получает username и имя отправителя"""
+        self.cursor.execute("SELECT username, first_name FROM senders WHERE user_id = ?", (sender_id,))
+        return self.cursor.fetchone() or (None, None)
     
     def get_user_messages(self, user_id, requesting_user_id=None):
         """Получает все сообщения пользователя"""
-        is_admin = self.is_admin(requesting_user_id) if requesting_user_id else False
+        # Данные отправителя выбираем сразу только для админа
+        with_sender = self.is_admin(requesting_user_id) if requesting_user_id else False
+        columns, join = (f"{MESSAGE_COLUMNS}, {SENDER_COLUMNS}", SENDER_JOIN) if with_sender else (MESSAGE_COLUMNS, "")
         
-        if is_admin:
-            self.cursor.execute('''
-                SELECT id, sender_id, sender_username, sender_first_name, 
-                       message_text, photo_file_id, sent_date, is_read, reply_to_message_id
-                FROM messages 
-                WHERE recipient_id = ?
-                ORDER BY sent_date DESC
-            ''', (user_id,))
-            return self.cursor.fetchall()
-        else:
-            self.cursor.execute('''
-                SELECT id, message_text, photo_file_id, sent_date, is_read, reply_to_message_id
-                FROM messages 
-                WHERE recipient_id = ?
-                ORDER BY sent_date DESC
-            ''', (user_id,))
-            return self.cursor.fetchall()
+        self.cursor.execute(f'''
+            SELECT {columns}
+            FROM messages {join}
+            WHERE recipient_id = ?
+            ORDER BY sent_date DESC
+        ''', (user_id,))
+        return [MessageRecord.from_row(row, self, with_sender) for row in self.cursor.fetchall()]
     
     def mark_message_as_read(self, message_id):
         """Отмечает сообщение как прочитанное"""
@@ -138,6 +557,15 @@ class Database:
             UPDATE messages SET is_read = 1 WHERE id = ?
         ''', (message_id,))
         self.conn.commit()
+        
+        # Обновляем кэш вместе с базой, чтобы следующее нажатие не шло в базу
+        message = self.message_cache.get(message_id)
+        if message is not None:
+            message.is_read = 1
+    
+    async def mark_message_as_read_async(self, message_id):
+        """mark_message_as_read для обработчиков"""
+        self.mark_message_as_read(message_id)
     
     def get_unread_count(self, user_id):
         """Получает количество непрочитанных сообщений"""
@@ -148,22 +576,39 @@ class Database:
         return self.cursor.fetchone()[0]
     
     def get_message_by_id(self, message_id, requesting_user_id=None):
-        """Получает сообщение по ID"""
-        is_admin = self.is_admin(requesting_user_id) if requesting_user_id else False
+        """Получает сообщение по ID: из кэша или из базы"""
+        message = self.message_cache.get(message_id)
+        if message is not None:
+            self.message_cache_hits += 1
+            self.message_cache.move_to_end(message_id)
+            return message
         
-        if is_admin:
-            self.cursor.execute('''
-                SELECT id, sender_id, sender_username, sender_first_name, 
-                       recipient_id, message_text, photo_file_id, sent_date, reply_to_message_id
-                FROM messages WHERE id = ?
-            ''', (message_id,))
-            return self.cursor.fetchone()
-        else:
-            self.cursor.execute('''
-                SELECT id, recipient_id, message_text, photo_file_id, sent_date, reply_to_message_id
-                FROM messages WHERE id = ?
-            ''', (message_id,))
-            return self.cursor.fetchone()
+        self.message_cache_misses += 1
+        message = self.load_message(message_id, requesting_user_id)
+        if message is not None:
+            self.message_cache[message_id] = message
+            if len(self.message_cache) > self.message_cache_size:
+                self.message_cache.popitem(last=False)
+        return message
+    
+    def load_message(self, message_id, requesting_user_id=None):
+        """Читает сообщение по ID из базы (ищет и в архиве)"""
+        with_sender = self.is_admin(requesting_user_id) if requesting_user_id else False
+        columns, join = (f"{MESSAGE_COLUMNS}, {SENDER_COLUMNS}", SENDER_JOIN) if with_sender else (MESSAGE_COLUMNS, "")
+        
+        self.cursor.execute(f"SELECT {columns} FROM messages {join} WHERE id = ?", (message_id,))
+        result = self.cursor.fetchone()
+        if result:
+            return MessageRecord.from_row(result, self, with_sender)
+        
+        # Старые сообщения перенесены в архив
+        self.cursor.execute(f"SELECT {columns} FROM {self.archive_table} {join} WHERE id = ?", (message_id,))
+        result = self.cursor.fetchone()
+        if not result:
+            return None
+        message = MessageRecord.from_row(result, self, with_sender)
+        message.text = decompress_text(message.text)
+        return message
     
     def get_all_users(self):
         """Получает список всех пользователей"""
@@ -173,15 +618,423 @@ class Database:
         ''')
         return self.cursor.fetchall()
     
-    def get_all_messages_admin(self, limit=100):
-        """Получает все сообщения для админа"""
+    def cache_thread_root(self, message_id, root_id):
+        """Запоминает корень переписки, вытесняя самые старые записи"""
+        self.thread_roots[message_id] = root_id
+        self.thread_roots.move_to_end(message_id)
+        if len(self.thread_roots) > self.thread_root_cache_size:
+            self.thread_roots.popitem(last=False)
+    
+    def get_thread_root(self, message_id, max_depth=50):
+        """Находит первое сообщение переписки, в которую входит сообщение"""
+        if message_id in self.thread_roots:
+            self.thread_roots.move_to_end(message_id)
+            return self.thread_roots[message_id]
+        
+        # Поднимаемся по reply_to_message_id одним запросом
+        self.cursor.execute('''
+            WITH RECURSIVE ancestors (id, parent_id, depth) AS (
+                SELECT id, reply_to_message_id, 0 FROM messages WHERE id = ?
+                UNION ALL
+                SELECT m.id, m.reply_to_message_id, a.depth + 1
+                FROM messages m
+                JOIN ancestors a ON m.id = a.parent_id
+                WHERE a.depth < ?
+            )
+            SELECT id FROM ancestors ORDER BY depth DESC LIMIT 1
+        ''', (message_id, max_depth))
+        result = self.cursor.fetchone()
+        if not result:
+            return None
+        
+        self.cache_thread_root(message_id, result[0])
+        return result[0]
+    
+    def has_replies(self, message_id):
+        """Проверяет, есть ли ответы на сообщение"""
+        self.cursor.execute('''
+            SELECT 1 FROM messages WHERE reply_to_message_id = ? LIMIT 1
+        ''', (message_id,))
+        return self.cursor.fetchone() is not None
+    
+    def get_thread(self, root_id, participant_id=None, after_id=0, limit=20,
+                   max_depth=50, max_messages=500):
+        """Получает страницу переписки от корня в порядке отправки"""
+        # Спускаемся от корня по индексу idx_messages_reply_to; глубина и
+        # общее число строк ограничены, чтобы длинная ветка не разрослась
         self.cursor.execute('''
-            SELECT m.id, m.sender_id, m.sender_username, m.sender_first_name,
-                   m.recipient_id, m.message_text, m.photo_file_id, m.sent_date, m.is_read,
+            WITH RECURSIVE thread (id, depth) AS (
+                SELECT id, 0 FROM messages WHERE id = ?
+                UNION ALL
+                SELECT m.id, t.depth + 1
+                FROM messages m
+                JOIN thread t ON m.reply_to_message_id = t.id
+                WHERE t.depth < ?
+                LIMIT ?
+            )
+            SELECT m.id, m.sender_id, m.recipient_id, m.message_text,
+                   m.media_count, m.sent_date, t.depth
+            FROM thread t
+            JOIN messages m ON m.id = t.id
+            WHERE m.id > ?
+              AND (? IS NULL OR m.sender_id = ? OR m.recipient_id = ?)
+            ORDER BY m.id
+            LIMIT ?
+        ''', (root_id, max_depth, max_messages, after_id,
+              participant_id, participant_id, participant_id, limit + 1))
+        rows = self.cursor.fetchall()
+        
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+    
+    def get_users_page(self, after_user_id=None, limit=15):
+        """Получает страницу пользователей (новые первыми) после курсора"""
+        if after_user_id is None:
+            self.cursor.execute('''
+                SELECT user_id, username, first_name, join_date, unique_link, is_admin
+                FROM users
+                ORDER BY join_date DESC, user_id DESC
+                LIMIT ?
+            ''', (limit + 1,))
+        else:
+            self.cursor.execute('''
+                SELECT user_id, username, first_name, join_date, unique_link, is_admin
+                FROM users
+                WHERE (join_date, user_id) < (SELECT join_date, user_id FROM users WHERE user_id = ?)
+                ORDER BY join_date DESC, user_id DESC
+                LIMIT ?
+            ''', (after_user_id, limit + 1))
+        rows = self.cursor.fetchall()
+        
+        # Лишняя строка только показывает, что есть следующая страница
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+    
+    def get_messages_page(self, before_id=None, limit=15, recipient_id=None, sender_id=None,
+                          date_from=None, date_to=None, has_photo=None, unread=None):
+        """Получает страницу сообщений для админа (новые первыми) с фильтрами"""
+        conditions = []
+        params = []
+        
+        if before_id is not None:
+            conditions.append("m.id < ?")
+            params.append(before_id)
+        if recipient_id is not None:
+            conditions.append("m.recipient_id = ?")
+            params.append(recipient_id)
+        if sender_id is not None:
+            conditions.append("m.sender_id = ?")
+            params.append(sender_id)
+        # id и sent_date растут вместе, поэтому даты превращаются в границы id:
+        # первое сообщение на дату находится одним поиском по idx_messages_sent_date,
+        # а страница остается диапазоном по id без сортировки всего периода.
+        # В индексе сообщения одной секунды идут по sender_id, поэтому первое из них
+        # выбирается явно по id
+        if date_from:
+            conditions.append('''m.id >= (
+                SELECT id FROM messages WHERE sent_date >= ? ORDER BY sent_date, id LIMIT 1
+            )''')
+            params.append(date_from)
+        if date_to:
+            conditions.append('''m.id < IFNULL(
+                (SELECT id FROM messages WHERE sent_date >= ? ORDER BY sent_date, id LIMIT 1),
+                (SELECT MAX(id) FROM messages) + 1
+            )''')
+            params.append(date_to)
+        if has_photo is not None:
+            conditions.append("m.media_count > 0" if has_photo else "m.media_count = 0")
+        if unread is not None:
+            conditions.append("m.is_read = 0" if unread else "m.is_read = 1")
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        self.cursor.execute(f'''
+            SELECT m.id, m.sender_id, s.username, s.first_name,
+                   m.recipient_id, m.message_text, m.media_count, m.sent_date, m.is_read,
                    u.username, u.first_name
             FROM messages m
+            LEFT JOIN senders s ON s.user_id = m.sender_id
             LEFT JOIN users u ON m.recipient_id = u.user_id
-            ORDER BY m.sent_date DESC
+            {where}
+            ORDER BY m.id DESC
             LIMIT ?
-        ''', (limit,))
-        return self.cursor.fetchall()
\ No newline at end of file
+        ''', (*params, limit + 1))
+        rows = self.cursor.fetchall()
+        
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+    
+    def search_messages(self, query, limit=10, offset=0, order='rank'):
+        """Ищет сообщения по тексту, наиболее релевантные первыми (order='id' - новые первыми)"""
+        terms = query.split()
+        if not terms:
+            return [], False
+        
+        if self.fts_enabled:
+            # Каждое слово берем в кавычки, чтобы ввод не разбирался как синтаксис FTS5
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+            self.cursor.execute(f'''
+                SELECT m.id, m.sender_id, m.recipient_id, m.sent_date, m.media_count,
+                       snippet(messages_fts, 0, '«', '»', '…', 12)
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE messages_fts MATCH ?
+                ORDER BY {'messages_fts.rowid DESC' if order == 'id' else 'rank'}
+                LIMIT ? OFFSET ?
+            ''', (match, limit + 1, offset))
+        else:
+            conditions = " AND ".join("message_text LIKE ?" for _ in terms)
+            self.cursor.execute(f'''
+                SELECT id, sender_id, recipient_id, sent_date, media_count, message_text
+                FROM messages
+                WHERE {conditions}
+                ORDER BY id DESC
+                LIMIT ? OFFSET ?
+            ''', (*[f"%{term}%" for term in terms], limit + 1, offset))
+        rows = self.cursor.fetchall()
+        return rows[:limit], len(rows) > limit
+    
+    def archive_messages(self, cutoff_date, include_unread=False, batch_size=500, compress=True):
+        """Переносит одну порцию старых сообщений в архив, возвращает их количество"""
+        # Порция выбирается по индексу idx_messages_sent_date
+        self.cursor.execute('''
+            SELECT id FROM messages
+            WHERE sent_date < ? AND (is_read = 1 OR ?)
+            ORDER BY sent_date
+            LIMIT ?
+        ''', (cutoff_date, 1 if include_unread else 0, batch_size))
+        ids = [row[0] for row in self.cursor.fetchall()]
+        if not ids:
+            return 0
+        
+        placeholders = ",".join("?" * len(ids))
+        archived_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        text_expr = "compress_text(message_text)" if compress else "message_text"
+        try:
+            # Сначала копируем, потом удаляем: при сбое между файлами
+            # сообщение останется в обеих таблицах, а не пропадет
+            self.cursor.execute(f'''
+                INSERT OR REPLACE INTO {self.archive_table} (
+                    id, recipient_id, sender_id,
+                    message_text, media_count, sent_date, is_read, reply_to_message_id, archived_date
+                )
+                SELECT id, recipient_id, sender_id,
+                       {text_expr}, media_count, sent_date, is_read, reply_to_message_id, ?
+                FROM messages WHERE id IN ({placeholders})
+            ''', (archived_date, *ids))
+            self.cursor.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", ids)
+            self.cursor.execute('''
+                UPDATE stats_counters SET value = value + ? WHERE name = 'archived'
+            ''', (len(ids),))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        
+        for message_id in ids:
+            self.message_cache.pop(message_id, None)
+        return len(ids)
+    
+    def get_setting(self, key, default=None):
+        """Получает значение настройки"""
+        self.cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
+        result = self.cursor.fetchone()
+        return result[0] if result else default
+    
+    def set_setting(self, key, value):
+        """Сохраняет значение настройки"""
+        self.cursor.execute('''
+            INSERT INTO settings (key, value) VALUES (?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        ''', (key, str(value)))
+        self.conn.commit()
+    
+    def get_banned_users(self):
+        """Получает ID всех заблокированных отправителей"""
+        self.cursor.execute("SELECT user_id FROM banned_users")
+        return [row[0] for row in self.cursor.fetchall()]
+    
+    def ban_user(self, user_id):
+        """Блокирует отправителя"""
+        banned_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.execute('''
+            INSERT OR IGNORE INTO banned_users (user_id, banned_date) VALUES (?, ?)
+        ''', (user_id, banned_date))
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
+    def unban_user(self, user_id):
+        """Снимает блокировку с отправителя"""
+        self.cursor.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
+    def get_user_ids_after(self, after_user_id, limit):
+        """Получает порцию ID пользователей по возрастанию после указанного"""
+        self.cursor.execute('''
+            SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?
+        ''', (after_user_id, limit))
+        return [row[0] for row in self.cursor.fetchall()]
+    
+    def create_broadcast(self, text, created_by):
+        """Создает рассылку"""
+        created_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.execute('''
+            INSERT INTO broadcasts (text, created_by, created_date, total)
+            VALUES (?, ?, ?, (SELECT value FROM stats_counters WHERE name = 'users'))
+        ''', (text, created_by, created_date))
+        self.conn.commit()
+        return self.cursor.lastrowid
+    
+    def get_broadcast(self, broadcast_id):
+        """Получает рассылку по ID"""
+        self.cursor.execute('''
+            SELECT id, text, status, last_user_id, delivered, blocked, failed, total, created_date
+            FROM broadcasts WHERE id = ?
+        ''', (broadcast_id,))
+        return self.cursor.fetchone()
+    
+    def get_latest_broadcast(self):
+        """Получает последнюю рассылку"""
+        self.cursor.execute('''
+            SELECT id, text, status, last_user_id, delivered, blocked, failed, total, created_date
+            FROM broadcasts ORDER BY id DESC LIMIT 1
+        ''')
+        return self.cursor.fetchone()
+    
+    def get_running_broadcast_ids(self):
+        """Получает ID незавершенных рассылок"""
+        self.cursor.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [row[0] for row in self.cursor.fetchall()]
+    
+    def update_broadcast_progress(self, broadcast_id, last_user_id, delivered, blocked, failed):
+        """Сохраняет прогресс рассылки после очередной порции"""
+        self.cursor.execute('''
+            UPDATE broadcasts
+            SET last_user_id = ?, delivered = delivered + ?, blocked = blocked + ?, failed = failed + ?
+            WHERE id = ?
+        ''', (last_user_id, delivered, blocked, failed, broadcast_id))
+        self.conn.commit()
+    
+    def set_broadcast_status(self, broadcast_id, status):
+        """Меняет статус рассылки"""
+        self.cursor.execute("UPDATE broadcasts SET status = ? WHERE id = ?", (status, broadcast_id))
+        self.conn.commit()
+    
+    def get_due_notifications(self, now, limit=50):
+        """Получает уведомления, которые пора отправить"""
+        self.cursor.execute('''
+            SELECT id, message_id, recipient_id, attempts FROM outbox
+            WHERE status = 'pending' AND next_attempt <= ?
+            ORDER BY next_attempt, id LIMIT ?
+        ''', (now, limit))
+        return self.cursor.fetchall()
+    
+    def get_next_notification_time(self):
+        """Время ближайшей попытки отправки (None, если очередь пуста)"""
+        self.cursor.execute("SELECT MIN(next_attempt) FROM outbox WHERE status = 'pending'")
+        return self.cursor.fetchone()[0]
+    
+    def get_pending_notification_count(self):
+        """Количество недоставленных уведомлений в очереди"""
+        self.cursor.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'")
+        return self.cursor.fetchone()[0]
+    
+    def complete_notifications(self, sent_ids, retries, failures):
+        """Сохраняет итоги порции одной транзакцией.
+
+        retries - [(attempts, next_attempt, ошибка, id)], failures - [(attempts, ошибка, id)].
+        """
+        if sent_ids:
+            placeholders = ",".join("?" * len(sent_ids))
+            self.cursor.execute(f"UPDATE outbox SET status = 'sent' WHERE id IN ({placeholders})", sent_ids)
+        self.cursor.executemany('''
+            UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?
+        ''', retries)
+        self.cursor.executemany('''
+            UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?
+        ''', failures)
+        self.conn.commit()
+    
+    def purge_notifications(self, before_date):
+        """Удаляет доставленные и окончательно не доставленные уведомления старше даты"""
+        self.cursor.execute('''
+            DELETE FROM outbox WHERE status != 'pending' AND created_date < ?
+        ''', (before_date,))
+        self.conn.commit()
+        return self.cursor.rowcount
+    
+    def get_message_cache_stats(self):
+        """Попадания и промахи кэша сообщений"""
+        return {
+            'size': len(self.message_cache),
+            'hits': self.message_cache_hits,
+            'misses': self.message_cache_misses
+        }
+    
+    def get_storage_info(self):
+        """Размер файла, свободные страницы и размер WAL"""
+        info = {}
+        for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum"):
+            self.cursor.execute(f"PRAGMA {pragma}")
+            info[pragma] = self.cursor.fetchone()[0]
+        info['file_size'] = info['page_size'] * info['page_count']
+        wal_path = self.db_name + "-wal"
+        info['wal_size'] = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+        return info
+    
+    def get_table_names(self):
+        """Обычные таблицы базы (без виртуальных и служебных)"""
+        self.cursor.execute('''
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND sql NOT LIKE 'CREATE VIRTUAL%'
+        ''')
+        return [row[0] for row in self.cursor.fetchall()]
+    
+    def analyze_table(self, table, analysis_limit=1000):
+        """Обновляет статистику планировщика по таблице, читая не больше analysis_limit строк индекса"""
+        self.cursor.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+        self.cursor.execute(f'ANALYZE "{table}"')
+        self.conn.commit()
+    
+    def optimize(self):
+        """PRAGMA optimize: планировщик сам решает, что еще переанализировать"""
+        self.cursor.execute("PRAGMA optimize")
+        self.conn.commit()
+    
+    def checkpoint(self, mode='PASSIVE'):
+        """Переносит WAL в основной файл, возвращает (busy, страниц в WAL, перенесено)"""
+        self.cursor.execute(f"PRAGMA wal_checkpoint({mode})")
+        return self.cursor.fetchone()
+    
+    def incremental_vacuum(self, pages):
+        """Возвращает системе до pages свободных страниц"""
+        # executescript выполняет PRAGMA до конца; execute освобождает только одну страницу за вызов
+        self.conn.commit()
+        self.cursor.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    
+    def get_stats(self):
+        """Получает сводную статистику для админ-панели"""
+        self.cursor.execute("SELECT name, value FROM stats_counters")
+        stats = dict(self.cursor.fetchall())
+        
+        # Активные отправители за сегодня - диапазон по индексу idx_messages_sent_date
+        today = datetime.now().strftime("%Y-%m-%d")
+        self.cursor.execute('''
+            SELECT COUNT(DISTINCT sender_id) FROM messages WHERE sent_date >= ?
+        ''', (today,))
+        stats['active_senders'] = self.cursor.fetchone()[0]
+        return stats
+
+
+def compress_text(text):
+    """Сжимает текст сообщения для хранения в архиве"""
+    if text is None:
+        return None
+    return zlib.compress(text.encode('utf-8'))
+
+
+def decompress_text(value):
+    """Восстанавливает текст сообщения из архива"""
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
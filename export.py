@@ -0,0 +1,157 @@
+import argparse
+import csv
+import gzip
+import heapq
+import json
+import os
+import sqlite3
+from itertools import groupby, islice
+
+from database import decompress_text
+from sharding import shard_paths
+
+# Таблицы для выгрузки и порядок строк в них; {archive} - таблица архива сообщений
+EXPORT_QUERIES = {
+    'users': 'SELECT * FROM users ORDER BY user_id',
+    'messages': 'SELECT * FROM messages ORDER BY id',
+    'archive': 'SELECT * FROM {archive} ORDER BY id',
+    'senders': 'SELECT * FROM senders ORDER BY user_id, updated_date',
+    'media': 'SELECT * FROM media ORDER BY id',
+    'message_media': 'SELECT * FROM message_media ORDER BY message_id, position',
+}
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Ключ слияния строк одной таблицы из нескольких файлов (тот же порядок, что в запросе)
+MERGE_KEYS = {
+    'users': lambda row: row[0],
+    'messages': lambda row: row[0],
+    'archive': lambda row: row[0],
+    'senders': lambda row: (row[0], row[3] or ''),
+    'media': lambda row: row[0],
+    'message_media': lambda row: (row[0], row[1]),
+}
+
+
+def database_sources(db):
+    """Файлы базы для выгрузки: [(путь базы, путь архива или None)], при шардировании - и шарды"""
+    return [(database.db_name, database.archive_path) for database in [db] + getattr(db, 'shards', [])]
+
+
+def source_rows(cursor, index, count, table):
+    """Строки таблицы одного файла в общей нумерации выгрузки"""
+    for row in cursor:
+        if table == 'archive':
+            # Текст в архиве может быть сжат
+            row = row[:3] + (decompress_text(row[3]),) + row[4:]
+        elif count > 1 and table == 'media':
+            # id фото свои в каждом файле: как у сообщений, id % count - номер файла
+            row = (row[0] * count + index,) + row[1:]
+        elif count > 1 and table == 'message_media':
+            row = row[:2] + (row[2] * count + index,) + row[3:]
+        yield row
+
+
+def latest_senders(rows):
+    """Отправитель пишется в шард каждого получателя: оставляем самый свежий профиль"""
+    for _, group in groupby(rows, key=lambda row: row[0]):
+        *_, last = group
+        yield last
+
+
+def write_rows(columns, rows, path, fmt, chunk_size):
+    """Пишет строки в сжатый файл порциями, возвращает их количество"""
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(columns)
+        
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            if writer:
+                writer.writerows(chunk)
+            else:
+                f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in chunk)
+            count += len(chunk)
+    return count
+
+
+def open_snapshot(db_path, archive_path):
+    """Соединение только для чтения; архив в отдельном файле подключается к нему же"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None)
+    archive = "messages_archive"
+    if archive_path and os.path.exists(archive_path):
+        conn.execute("ATTACH DATABASE ? AS archive", (f"file:{archive_path}?mode=ro",))
+        archive = "archive.messages_archive"
+    return conn, archive
+
+
+def export_database(sources, out_dir, fmt='csv', tables=None, chunk_size=1000):
+    """Выгружает таблицы всех файлов базы в сжатые файлы из согласованных снимков.
+
+    sources - [(путь базы, путь архива или None)]: основной файл и шарды.
+    Строки одной таблицы из разных файлов сливаются в одном порядке.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    tables = tables or list(EXPORT_QUERIES)
+    os.makedirs(out_dir, exist_ok=True)
+    
+    # Отдельные соединения только для чтения: в режиме WAL транзакция каждого
+    # видит снимок на момент первого чтения и не мешает боту записывать сообщения
+    snapshots = []
+    results = []
+    try:
+        for db_path, archive_path in sources:
+            snapshots.append(open_snapshot(db_path, archive_path))
+        # Снимки всех файлов берем сразу, до выгрузки первой таблицы
+        for conn, archive in snapshots:
+            conn.execute("BEGIN")
+            conn.execute(f"SELECT 1 FROM {archive} LIMIT 1").fetchall()
+        
+        for table in tables:
+            path = os.path.join(out_dir, f"{table}.{fmt}.gz")
+            query = EXPORT_QUERIES[table]
+            cursors = []
+            for index, (conn, archive) in enumerate(snapshots):
+                cursor = conn.execute(query.format(archive=archive))
+                cursors.append(source_rows(cursor, index, len(snapshots), table))
+            columns = [column[0] for column in cursor.description]
+            rows = heapq.merge(*cursors, key=MERGE_KEYS[table])
+            if table == 'senders':
+                rows = latest_senders(rows)
+            results.append((path, write_rows(columns, rows, path, fmt, chunk_size)))
+        
+        for conn, _ in snapshots:
+            conn.execute("COMMIT")
+    finally:
+        for conn, _ in snapshots:
+            conn.close()
+    return results
+
+
+def main():
+    """Выгрузка базы из командной строки"""
+    parser = argparse.ArgumentParser(description="Выгрузка пользователей и сообщений бота")
+    parser.add_argument('--db', default='bot_database.db', help="путь к базе данных")
+    parser.add_argument('--archive', help="файл архива (ARCHIVE_DB_PATH), если архив отдельно")
+    parser.add_argument('--shards', type=int, default=0, help="число шардов (DB_SHARDS)")
+    parser.add_argument('--out', default='exports', help="папка для файлов выгрузки")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--tables', nargs='+', choices=list(EXPORT_QUERIES), help="таблицы (по умолчанию все)")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="строк за одно чтение")
+    args = parser.parse_args()
+    
+    sources = [(args.db, args.archive)]
+    if args.shards > 1:
+        archives = shard_paths(args.archive, args.shards) if args.archive else [None] * args.shards
+        sources.extend(zip(shard_paths(args.db, args.shards), archives))
+    
+    for path, count in export_database(sources, args.out, args.format, args.tables, args.chunk_size):
+        print(f"{path}: {count} строк")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import importlib.util
+import logging
+import time
+
+from telegram.error import TimedOut
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Методы с загрузкой файлов получают отдельный, более длинный класс таймаутов
+MEDIA_METHODS = frozenset({
+    'sendPhoto', 'sendMediaGroup', 'sendDocument', 'sendVideo', 'sendAnimation',
+    'sendAudio', 'sendVoice', 'editMessageMedia',
+})
+
+# Ключ bot_data, под которым лежат созданные пулы
+POOLS_KEY = 'http_pools'
+
+
+class PooledRequest(HTTPXRequest):
+    """HTTP-клиент Bot API с классами таймаутов по методу и метриками пула"""
+
+    def __init__(self, name, connection_pool_size, timeouts, media_timeout=None, http_version='1.1'):
+        super().__init__(connection_pool_size=connection_pool_size, http_version=http_version, **timeouts)
+        self.name = name
+        self.pool_size = connection_pool_size
+        self.media_timeout = media_timeout if media_timeout is not None else timeouts.get('write_timeout')
+        # Загрузки идут через свой клиент, у которого таймауты по умолчанию - медийные
+        self.media = HTTPXRequest(
+            connection_pool_size=connection_pool_size, http_version=http_version,
+            **{**timeouts, 'read_timeout': self.media_timeout, 'write_timeout': self.media_timeout}
+        )
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.pool_timeouts = 0
+        self.errors = 0
+        # Класс таймаутов -> [число запросов, суммарное время, максимум]
+        self.timings = {}
+
+    async def initialize(self):
+        await super().initialize()
+        await self.media.initialize()
+
+    async def shutdown(self):
+        await super().shutdown()
+        await self.media.shutdown()
+
+    async def do_request(self, url, method, request_data=None,
+                         read_timeout=HTTPXRequest.DEFAULT_NONE, write_timeout=HTTPXRequest.DEFAULT_NONE,
+                         connect_timeout=HTTPXRequest.DEFAULT_NONE, pool_timeout=HTTPXRequest.DEFAULT_NONE):
+        """Выполняет запрос, подставляя таймауты класса, если вызов не задал свои"""
+        timeout_class = 'default'
+        send = super().do_request
+        if url.rsplit('/', 1)[-1] in MEDIA_METHODS:
+            timeout_class = 'media'
+            send = self.media.do_request
+            # С файлами HTTPXRequest берет 20 с вместо write_timeout клиента
+            if write_timeout is self.DEFAULT_NONE:
+                write_timeout = self.media_timeout
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            return await send(
+                url, method, request_data,
+                read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+        except TimedOut as e:
+            # Все соединения пула заняты - запрос даже не ушел в Telegram
+            if 'Pool timeout' in str(e):
+                self.pool_timeouts += 1
+            self.errors += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.requests += 1
+            elapsed = time.perf_counter() - started
+            timing = self.timings.setdefault(timeout_class, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+
+    def format_stats(self):
+        """Строка с загрузкой пула для админ-панели"""
+        latency = ", ".join(
+            f"{timeout_class} {total / count * 1000:.0f}/{peak * 1000:.0f} мс"
+            for timeout_class, (count, total, peak) in self.timings.items() if count
+        )
+        return (f"{self.name} (HTTP/{self.http_version}): в работе {self.in_flight}/{self.pool_size}, "
+                f"пик {self.peak_in_flight}, запросов {self.requests}, ошибок {self.errors}, "
+                f"таймаутов пула {self.pool_timeouts}" + (f"; ср./макс.: {latency}" if latency else ""))
+
+
+def resolve_http_version(requested):
+    """HTTP/2 включаем, только если установлен пакет h2 (httpx[http2])"""
+    if requested.startswith('2') and importlib.util.find_spec('h2') is None:
+        logger.warning("Пакет h2 не установлен, Bot API работает по HTTP/1.1")
+        return '1.1'
+    return requested
+
+
+def application_builder(token, pool_size, updates_pool_size, timeouts, media_timeout, http_version):
+    """Сборщик Application с отдельными пулами для getUpdates и исходящих вызовов.
+
+    Возвращает (сборщик, пулы): пулы сохраняются в bot_data под POOLS_KEY
+    после сборки, чтобы админ-панель читала метрики без приватных полей Bot.
+    """
+    http_version = resolve_http_version(http_version)
+    request = PooledRequest('api', pool_size, timeouts, media_timeout, http_version)
+    # getUpdates - один долгий запрос; read_timeout для него задает сам run_polling
+    get_updates_request = PooledRequest('updates', updates_pool_size, timeouts, http_version=http_version)
+    builder = Application.builder().token(token).request(request).get_updates_request(get_updates_request)
+    return builder, [request, get_updates_request]
+
+
+def format_pool_stats(bot_data):
+    """Метрики HTTP-пулов из bot_data; пустая строка, если пулы не сохранены"""
+    return "\n".join(request.format_stats() for request in bot_data.get(POOLS_KEY, ()))
@@ -0,0 +1,141 @@
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+def update_type(update):
+    """Тип обновления: message, callback_query и т.д."""
+    if isinstance(update, Update):
+        for name in Update.ALL_TYPES:
+            if getattr(update, name, None) is not None:
+                return name
+    return type(update).__name__
+
+
+def callback_prefix(update):
+    """Код действия кнопки (часть callback_data до первого ":")"""
+    if isinstance(update, Update) and update.callback_query and update.callback_query.data:
+        return update.callback_query.data.split(":", 1)[0]
+    return None
+
+
+class LoopLagMonitor:
+    """Измеряет задержку цикла событий и ищет медленные обработчики.
+
+    Корутина run() просыпается каждые interval секунд; насколько позже
+    она проснулась - столько цикл был занят чужим кодом. Отдельный поток
+    замечает зависание, пока оно еще длится, и пишет в лог стек потока
+    цикла, чтобы было видно, какой синхронный код его держит.
+    """
+
+    def __init__(self, interval=0.1, stall_threshold=0.5, slow_handler_threshold=1.0, samples=3000):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.slow_handler_threshold = slow_handler_threshold
+        self.lags = deque(maxlen=samples)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.slow_handlers = 0
+        self.heartbeat = None
+        self.loop_thread_id = None
+        self.task = None
+        self._watchdog = None
+
+    def start(self):
+        """Запускает замеры в текущем цикле событий.
+
+        Задача не регистрируется через Application.create_task: Application.stop
+        ждет такие задачи, и бесконечный цикл замеров не дал бы боту остановиться.
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        """Бесконечный цикл замеров"""
+        loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.heartbeat = time.monotonic()
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.stall_threshold:
+                self.stalls += 1
+                logger.warning(f"Цикл событий был занят {lag * 1000:.0f} мс")
+
+    def _watch(self):
+        """Поток-сторож: стек потока цикла, если цикл завис прямо сейчас"""
+        reported = None
+        while True:
+            time.sleep(self.stall_threshold / 2)
+            heartbeat = self.heartbeat
+            if time.monotonic() - heartbeat <= self.stall_threshold + self.interval or heartbeat == reported:
+                continue
+            # Одно зависание - одна запись в логе
+            reported = heartbeat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame, limit=15)) if frame is not None else "стек недоступен"
+            logger.warning(f"Цикл событий завис дольше {self.stall_threshold} с, стек:\n{stack}")
+
+    def current_stall(self):
+        """Сколько секунд цикл не отвечает прямо сейчас (None, если монитор не запущен)"""
+        if self.heartbeat is None:
+            return None
+        return max(0.0, time.monotonic() - self.heartbeat - self.interval)
+
+    def percentiles(self):
+        """p50/p95/p99 и максимум задержки в мс по последним замерам"""
+        lags = sorted(self.lags)
+        if not lags:
+            return {}
+        result = {f"p{q}": lags[min(len(lags) - 1, len(lags) * q // 100)] * 1000 for q in (50, 95, 99)}
+        result['max'] = self.max_lag * 1000
+        return result
+
+    def wrap(self, callback):
+        """Обертка обработчика PTB: пишет в лог вызовы дольше порога"""
+        @functools.wraps(callback)
+        async def timed(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                elapsed = time.perf_counter() - started
+                if elapsed > self.slow_handler_threshold:
+                    self.slow_handlers += 1
+                    prefix = callback_prefix(update)
+                    logger.warning(
+                        f"Медленный обработчик {callback.__name__}: {elapsed * 1000:.0f} мс, "
+                        f"обновление {update_type(update)}" + (f", кнопка {prefix}" if prefix else "")
+                    )
+        return timed
+
+    def format_text(self):
+        """Строка с задержкой цикла для админ-панели"""
+        stats = self.percentiles()
+        if not stats:
+            return "⏱ Задержка цикла: нет данных"
+        return (f"⏱ Задержка цикла: p50 {stats['p50']:.1f} / p95 {stats['p95']:.1f} / "
+                f"p99 {stats['p99']:.1f} мс, макс. {stats['max']:.0f} мс; "
+                f"зависаний {self.stalls}, медленных обработчиков {self.slow_handlers}")
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def parse_window(value):
+    """Разбирает окно обслуживания вида "3-6" (часы, локальное время)"""
+    start, _, end = value.partition("-")
+    return int(start), int(end or start)
+
+
+def format_size(size):
+    for unit in ("Б", "КБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    if size < 1024:
+        return f"{size:.1f} МБ"
+    return f"{size / 1024:.1f} ГБ"
+
+
+class DatabaseMaintenance:
+    """Обслуживание SQLite в тихие часы короткими шагами.
+
+    Каждый шаг - отдельная транзакция, между шагами управление возвращается
+    циклу событий, поэтому блокировка записи не держится долго.
+    """
+
+    def __init__(self, databases, window=(3, 6), vacuum_step=200, max_vacuum_steps=50, analysis_limit=1000):
+        self.databases = databases
+        self.window = window
+        self.vacuum_step = vacuum_step
+        self.max_vacuum_steps = max_vacuum_steps
+        self.analysis_limit = analysis_limit
+        self.last_run_date = None
+        self.last_run_label = None
+        self.last_duration = 0.0
+
+    def in_window(self, now=None):
+        """Попадает ли время в тихие часы (окно может переходить через полночь)"""
+        hour = (now or datetime.now()).hour
+        start, end = self.window
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    async def run(self, force=False):
+        """Цикл обслуживания раз в сутки в окне; вне окна только пассивный checkpoint"""
+        for db in self.databases:
+            db.checkpoint('PASSIVE')
+
+        today = datetime.now().strftime("%Y-%m-%d")
+        if not force and (not self.in_window() or self.last_run_date == today):
+            return False
+
+        started = time.monotonic()
+        for db in self.databases:
+            for table in db.get_table_names():
+                db.analyze_table(table, self.analysis_limit)
+                await asyncio.sleep(0)
+            db.optimize()
+            await asyncio.sleep(0)
+
+            # Без auto_vacuum=INCREMENTAL (старые базы) incremental_vacuum ничего не делает
+            if db.get_storage_info()['auto_vacuum'] == 2:
+                for _ in range(self.max_vacuum_steps):
+                    if db.get_storage_info()['freelist_count'] == 0:
+                        break
+                    db.incremental_vacuum(self.vacuum_step)
+                    await asyncio.sleep(0)
+
+            busy, log_pages, checkpointed = db.checkpoint('TRUNCATE')
+            if busy:
+                logger.info(f"Checkpoint {db.db_name} отложен: база занята чтением")
+            await asyncio.sleep(0)
+
+        self.last_run_date = today
+        self.last_run_label = datetime.now().strftime("%Y-%m-%d %H:%M")
+        self.last_duration = time.monotonic() - started
+        logger.info(f"Обслуживание базы завершено за {self.last_duration:.1f} с")
+        return True
+
+    def format_text(self):
+        """Состояние файлов базы для админ-панели"""
+        lines = []
+        for db in self.databases:
+            info = db.get_storage_info()
+            lines.append(f"💾 `{db.db_name}`: {format_size(info['file_size'])}, "
+                         f"свободных страниц {info['freelist_count']}, WAL {format_size(info['wal_size'])}"
+                         f"{'' if info['auto_vacuum'] == 2 else ' (без auto_vacuum)'}")
+        if self.last_run_label:
+            lines.append(f"🧹 Обслуживание: {self.last_run_label} ({self.last_duration:.1f} с)")
+        else:
+            lines.append(f"🧹 Обслуживание: еще не выполнялось (окно {self.window[0]}-{self.window[1]} ч)")
+        return "\n".join(lines)
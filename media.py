@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+from telegram import InputMediaPhoto
+
+logger = logging.getLogger(__name__)
+
+# Telegram принимает в send_media_group не больше 10 элементов
+MAX_ALBUM_SIZE = 10
+
+
+class PendingAlbum:
+    """Фото одного альбома, собранные из отдельных обновлений"""
+
+    __slots__ = ('photos', 'caption', 'task')
+
+    def __init__(self, photo, caption):
+        self.photos = [photo]
+        self.caption = caption
+        self.task = None
+
+
+class AlbumCollector:
+    """Собирает фото с одним media_group_id в один альбом за короткое окно"""
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.pending = {}
+
+    def add(self, user_id, media_group_id, photo, caption):
+        """Добавляет фото к уже открытому альбому; False, если альбома еще нет"""
+        album = self.pending.get((user_id, media_group_id))
+        if album is None:
+            return False
+        if len(album.photos) < MAX_ALBUM_SIZE:
+            album.photos.append(photo)
+        # Подпись обычно только у одного фото альбома
+        if caption and not album.caption:
+            album.caption = caption
+        return True
+
+    def open(self, user_id, media_group_id, photo, caption, deliver):
+        """Открывает альбом; deliver(album) вызывается после окна сбора"""
+        key = (user_id, media_group_id)
+        album = PendingAlbum(photo, caption)
+        self.pending[key] = album
+        album.task = asyncio.create_task(self.flush(key, deliver))
+
+    def discard(self, user_id, media_group_id):
+        """Открывает альбом, фото которого отбрасываются: на весь альбом - один ответ"""
+        self.open(user_id, media_group_id, None, None, self._drop)
+
+    @staticmethod
+    async def _drop(album):
+        pass
+
+    async def flush(self, key, deliver):
+        await asyncio.sleep(self.window)
+        album = self.pending.pop(key)
+        try:
+            await deliver(album)
+        except Exception as e:
+            logger.error(f"Не удалось отправить альбом: {e}")
+
+
+def media_group(file_ids, caption, parse_mode='Markdown'):
+    """Собирает альбом для send_media_group; подпись ставится на первое фото"""
+    return [
+        InputMediaPhoto(file_id, caption=caption if i == 0 else None, parse_mode=parse_mode)
+        for i, file_id in enumerate(file_ids)
+    ]
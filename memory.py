@@ -0,0 +1,150 @@
+import gc
+import sys
+import time
+import tracemalloc
+
+from maintenance import format_size
+
+
+def rss_bytes():
+    """Текущий RSS процесса; None, если /proc недоступен"""
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def deep_size(obj, skip=(), max_objects=100000):
+    """Примерный размер объекта вместе со вложенными контейнерами.
+
+    Общие объекты считаются один раз, объекты типов skip (например, ссылка
+    записи на базу) не обходятся; обход ограничен max_objects, чтобы не
+    подвешивать бота на огромных структурах.
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack and len(seen) < max_objects:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, skip):
+            continue
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__slots__'):
+            stack.extend(getattr(item, name) for name in item.__slots__ if hasattr(item, name))
+        elif hasattr(item, '__dict__'):
+            stack.append(item.__dict__)
+    return size
+
+
+class ConversationJanitor:
+    """Удаляет состояние диалогов (user_data/chat_data), брошенное пользователями.
+
+    PTB хранит user_data для каждого, кто хоть раз писал боту, и никогда
+    его не удаляет. Janitor запоминает время последнего обновления от
+    пользователя и раз в sweep удаляет данные тех, кто молчит дольше ttl.
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.last_seen = {}
+        self.evicted = 0
+
+    def touch(self, user_id, chat_id=None):
+        """Отмечает активность пользователя (и его чата)"""
+        now = time.monotonic()
+        self.last_seen[('user', user_id)] = now
+        if chat_id is not None:
+            self.last_seen[('chat', chat_id)] = now
+
+    def sweep(self, application, now=None):
+        """Удаляет данные пользователей и чатов, неактивных дольше ttl"""
+        now = time.monotonic() if now is None else now
+        evicted = 0
+        for kind, storage, drop in (('user', application.user_data, application.drop_user_data),
+                                    ('chat', application.chat_data, application.drop_chat_data)):
+            for key in list(storage):
+                # Данные без отметки (например, после перезапуска) считаем свежими
+                last_seen = self.last_seen.setdefault((kind, key), now)
+                if now - last_seen > self.ttl:
+                    drop(key)
+                    del self.last_seen[(kind, key)]
+                    evicted += 1
+
+        # Отметки без данных не нужны: пользователь вернется - отметка появится снова
+        border = now - self.ttl
+        stale = [key for key, last_seen in self.last_seen.items() if last_seen <= border]
+        for key in stale:
+            del self.last_seen[key]
+
+        self.evicted += evicted
+        return evicted
+
+
+class MemoryTracker:
+    """Снимки tracemalloc по запросу и разница между соседними снимками.
+
+    tracemalloc замедляет выделение памяти, поэтому включается только
+    первым снимком и выключается командой.
+    """
+
+    def __init__(self, frames=10):
+        self.frames = frames
+        self.snapshot = None
+        self.previous = None
+        self.taken_at = None
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def take_snapshot(self):
+        """Делает снимок; первый вызов только включает трассировку и снимает базу"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        self.previous, self.snapshot = self.snapshot, snapshot
+        self.taken_at = time.strftime("%H:%M:%S")
+        return snapshot
+
+    def top(self, limit=10):
+        """Строки кода, удерживающие больше всего памяти в последнем снимке"""
+        if self.snapshot is None:
+            return []
+        return self.snapshot.statistics('lineno')[:limit]
+
+    def diff(self, limit=10):
+        """Наибольший прирост памяти между двумя последними снимками"""
+        if self.snapshot is None or self.previous is None:
+            return []
+        return self.snapshot.compare_to(self.previous, 'lineno')[:limit]
+
+    def stop(self):
+        """Выключает трассировку и освобождает снимки"""
+        tracemalloc.stop()
+        self.snapshot = self.previous = None
+
+
+def format_stat(stat):
+    """Строка статистики tracemalloc: файл:строка, размер и прирост"""
+    frame = stat.traceback[0]
+    line = f"{frame.filename.rsplit('/', 1)[-1]}:{frame.lineno} {format_size(stat.size)} ({stat.count} шт.)"
+    if getattr(stat, 'size_diff', None):
+        sign = "+" if stat.size_diff > 0 else "-"
+        line += f", {sign}{format_size(abs(stat.size_diff))}"
+    return line
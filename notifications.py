@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from router import CallbackRouter
+
+logger = logging.getLogger(__name__)
+
+
+class PendingNotification:
+    """Последнее уведомление получателя, в которое сливаются новые сообщения"""
+
+    __slots__ = ('message_id', 'is_photo', 'is_album', 'count', 'started', 'last_edit', 'flush_task', 'waiters')
+
+    def __init__(self, is_photo, started, is_album=False):
+        self.message_id = None
+        self.is_photo = is_photo
+        self.is_album = is_album
+        self.count = 1
+        self.started = started
+        self.last_edit = started
+        self.flush_task = None
+        # Future влитых сообщений: решаются, когда правка с ними дошла или сорвалась
+        self.waiters = []
+
+
+class NotificationCoalescer:
+    """Объединяет частые уведомления одному получателю в одно редактируемое"""
+
+    def __init__(self, window=60, edit_interval=5, sweep_threshold=1000):
+        self.window = window
+        self.edit_interval = edit_interval
+        self.sweep_threshold = sweep_threshold
+        self.pending = {}
+
+    async def notify(self, bot, recipient_id, send, is_photo=False, is_album=False):
+        """Отправляет уведомление через send() или добавляет его к недавнему.
+
+        Для альбома send() возвращает список сообщений, правится подпись первого.
+        Возвращает None, если уведомление отправлено, или future, которая
+        завершится после правки недавнего уведомления (с ошибкой правки, если та не прошла).
+        """
+        now = time.monotonic()
+        state = self.pending.get(recipient_id)
+
+        if state is None or now - state.started > self.window:
+            if len(self.pending) > self.sweep_threshold:
+                self.sweep(now)
+
+            # Состояние заводим до отправки, чтобы параллельные сообщения
+            # не отправили второе уведомление, пока первое в пути
+            state = PendingNotification(is_photo or is_album, now, is_album)
+            self.pending[recipient_id] = state
+            try:
+                message = await send()
+            except Exception:
+                self.pending.pop(recipient_id, None)
+                raise
+            state.message_id = message[0].message_id if is_album else message.message_id
+            return None
+
+        state.count += 1
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        if state.flush_task is None:
+            delay = max(0.0, state.last_edit + self.edit_interval - now)
+            state.flush_task = asyncio.create_task(self.flush(bot, recipient_id, state, delay))
+        return waiter
+
+    async def flush(self, bot, recipient_id, state, delay):
+        """Обновляет уведомление не чаще одного раза за edit_interval"""
+        await asyncio.sleep(delay)
+        while state.message_id is None and self.pending.get(recipient_id) is state:
+            await asyncio.sleep(self.edit_interval)
+
+        state.flush_task = None
+        state.last_edit = time.monotonic()
+        waiters, state.waiters = state.waiters, []
+        if state.message_id is None:
+            self.resolve(state, waiters, RuntimeError("первое уведомление не отправлено"))
+            return
+
+        text = (f"📩 **Новых анонимных сообщений: {state.count}**\n\n"
+                f"📨 Откройте «Мои сообщения», чтобы прочитать и ответить")
+        # У сообщений альбома не бывает кнопок
+        reply_markup = None if state.is_album else InlineKeyboardMarkup(
+            [[InlineKeyboardButton("📨 Мои сообщения", callback_data=CallbackRouter.encode("msgs"))]]
+        )
+        try:
+            if state.is_photo:
+                await bot.edit_message_caption(
+                    chat_id=recipient_id, message_id=state.message_id,
+                    caption=text, reply_markup=reply_markup, parse_mode='Markdown'
+                )
+            else:
+                await bot.edit_message_text(
+                    text, chat_id=recipient_id, message_id=state.message_id,
+                    reply_markup=reply_markup, parse_mode='Markdown'
+                )
+        except Exception as e:
+            logger.error(f"Не удалось обновить уведомление: {e}")
+            self.resolve(state, waiters, e)
+            return
+        self.resolve(state, waiters)
+
+    @staticmethod
+    def resolve(state, waiters, error=None):
+        """Сообщает влитым сообщениям итог правки; не показанные в ней не считаются"""
+        if error is not None:
+            state.count -= len(waiters)
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if error is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(error)
+
+    def sweep(self, now):
+        """Удаляет устаревшие записи без запланированного обновления"""
+        stale = [recipient_id for recipient_id, state in self.pending.items()
+                 if now - state.started > self.window and state.flush_task is None]
+        for recipient_id in stale:
+            del self.pending[recipient_id]
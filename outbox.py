@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker:
+    """Доставляет уведомления из таблицы outbox с повторами и нарастающей паузой.
+
+    Обработчик только сохраняет сообщение вместе со строкой outbox и будит
+    worker, не дожидаясь Telegram. Worker забирает порции, отправляет их
+    (уведомления одному получателю - по порядку) и записывает итоги порции
+    одной транзакцией. Строки переживают перезапуск: доставка как минимум
+    один раз. Уведомление, влитое в уже отправленное, закрывается только после
+    правки того уведомления; до тех пор строка ждет в очереди lease секунд и
+    после перезапуска будет отправлена снова.
+    """
+
+    def __init__(self, databases, build, notifier, batch_size=50, max_attempts=8,
+                 base_delay=2, max_delay=600, poll_interval=5, keep_days=7, lease=60):
+        self.databases = databases
+        # build(bot, message_id) -> (send, is_photo, is_album) или None, если сообщения нет
+        self.build = build
+        self.notifier = notifier
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.keep_days = keep_days
+        self.lease = lease
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.last_purge = 0.0
+        self.task = None
+        # Строки, которые ждут правки общего уведомления
+        self.deferred = set()
+        self._wakeup = asyncio.Event()
+
+    def start(self, bot):
+        """Запускает доставку в текущем цикле событий.
+
+        Как и монитор цикла, задача не регистрируется через Application.create_task,
+        иначе бесконечный цикл доставки не дал бы приложению остановиться.
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run(bot))
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        # Незакрытые строки останутся в outbox и уйдут снова после перезапуска
+        for task in list(self.deferred):
+            task.cancel()
+
+    def wake(self):
+        """Будит worker после записи нового уведомления"""
+        self._wakeup.set()
+
+    async def run(self, bot):
+        """Бесконечный цикл доставки"""
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.process(bot):
+                    continue
+                self.purge()
+            except Exception as e:
+                logger.error(f"Ошибка доставки уведомлений: {e}")
+
+            # Спим до ближайшей повторной попытки, но не дольше poll_interval
+            next_times = [t for t in (db.get_next_notification_time() for db in self.databases) if t is not None]
+            timeout = self.poll_interval
+            if next_times:
+                timeout = min(timeout, max(0.0, min(next_times) - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process(self, bot):
+        """Отправляет по порции из каждой базы; возвращает число обработанных строк"""
+        processed = 0
+        for db in self.databases:
+            rows = db.get_due_notifications(time.time(), self.batch_size)
+            if not rows:
+                continue
+            by_recipient = defaultdict(list)
+            for row in rows:
+                by_recipient[row[2]].append(row)
+            results = await asyncio.gather(*(self.deliver_all(bot, recipient_rows)
+                                             for recipient_rows in by_recipient.values()))
+            self.complete(db, [result for recipient_results in results for result in recipient_results])
+            processed += len(rows)
+        return processed
+
+    def complete(self, db, results):
+        """Записывает итоги попыток [(строка, (статус, пауза, ошибка))] одной транзакцией"""
+        sent_ids, retries, leases, failures = [], [], [], []
+        for row, (status, delay, error) in results:
+            outbox_id, _, _, attempts = row
+            if status == 'sent':
+                sent_ids.append(outbox_id)
+            elif status == 'deferred':
+                # delay - ожидание правки общего уведомления; попытка не считается
+                leases.append((attempts, time.time() + self.lease, None, outbox_id))
+                self.defer(db, row, delay)
+            elif status == 'retry' and attempts + 1 < self.max_attempts:
+                retries.append((attempts + 1, time.time() + delay, error, outbox_id))
+            else:
+                failures.append((attempts + 1, error, outbox_id))
+        db.complete_notifications(sent_ids, retries + leases, failures)
+        self.sent += len(sent_ids)
+        self.retried += len(retries)
+        self.failed += len(failures)
+
+    def defer(self, db, row, edit):
+        """Закроет строку, когда правка общего уведомления пройдет или сорвется"""
+        task = asyncio.create_task(self.complete_deferred(db, row, edit))
+        self.deferred.add(task)
+        task.add_done_callback(self.deferred.discard)
+
+    async def complete_deferred(self, db, row, edit):
+        try:
+            await edit
+            outcome = 'sent', 0, None
+        except Exception as e:
+            outcome = self.failure(row, e)
+        self.complete(db, [(row, outcome)])
+
+    async def deliver_all(self, bot, rows):
+        """Уведомления одному получателю по порядку: объединение в одно уведомление зависит от порядка"""
+        return [(row, await self.deliver(bot, row)) for row in rows]
+
+    async def deliver(self, bot, row):
+        """Отправляет одно уведомление: ('sent' | 'deferred' | 'retry' | 'failed', пауза или правка, ошибка)"""
+        try:
+            # Ошибка чтения сообщения из базы - такой же повод для повтора, как ошибка сети
+            notification = self.build(bot, row[1])
+            if notification is None:
+                return 'failed', 0, "сообщение не найдено"
+            send, is_photo, is_album = notification
+            edit = await self.notifier.notify(bot, row[2], send, is_photo=is_photo, is_album=is_album)
+            if edit is not None:
+                return 'deferred', edit, None
+            return 'sent', 0, None
+        except Exception as e:
+            return self.failure(row, e)
+
+    def failure(self, row, error):
+        """Итог неудачной попытки: ('retry' | 'failed', пауза, ошибка)"""
+        outbox_id, _, recipient_id, attempts = row
+        if isinstance(error, RetryAfter):
+            return 'retry', error.retry_after, str(error)
+        # Ошибку разметки отправка исправляет сама (повтор без Markdown); если она все же
+        # дошла сюда, это не причина терять уведомление
+        if isinstance(error, Forbidden) or (
+                isinstance(error, BadRequest) and "can't parse entities" not in str(error).lower()):
+            # Бот заблокирован, чат не найден или файл не принят - повтор не поможет
+            logger.info(f"Уведомление {outbox_id} для {recipient_id} не доставлено: {error}")
+            return 'failed', 0, str(error)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempts) * random.uniform(0.5, 1.0)
+        logger.warning(f"Уведомление {outbox_id} для {recipient_id}: {error}, повтор через {delay:.1f} с")
+        return 'retry', delay, str(error)
+
+    def purge(self):
+        """Раз в час удаляет старые завершенные строки outbox"""
+        if time.monotonic() - self.last_purge < 3600:
+            return
+        self.last_purge = time.monotonic()
+        before = (datetime.now() - timedelta(days=self.keep_days)).strftime("%Y-%m-%d %H:%M:%S")
+        for db in self.databases:
+            db.purge_notifications(before)
+
+    def format_text(self):
+        """Строка очереди уведомлений для админ-панели"""
+        pending = sum(db.get_pending_notification_count() for db in self.databases)
+        return (f"📬 Уведомления: в очереди {pending}, доставлено {self.sent}, "
+                f"повторов {self.retried}, не доставлено {self.failed}")
@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+from collections import Counter
+
+
+def frame_label(frame):
+    """Имя функции с файлом и строкой начала - одна ступень стека"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Сэмплирующий профайлер: раз в interval снимает стеки всех потоков.
+
+    Работает в своем потоке и не трогает профилируемый код, поэтому его можно
+    включать на живом боте. Результат - collapsed stacks (формат flamegraph.pl
+    и speedscope): "поток;внешняя функция;...;внутренняя функция количество".
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Сбрасывает прошлые результаты и запускает поток снимков"""
+        self.stacks.clear()
+        self.samples = 0
+        self.running = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает поток снимков, результаты остаются в stacks"""
+        self._stop.set()
+        self._thread.join()
+        self.running = False
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        """Пишет стеки в файл, самые частые первыми"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top_functions(self, limit=10):
+        """Функции, чаще всего оказывавшиеся на вершине стека"""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
@@ -0,0 +1,67 @@
+# Колонки сообщения, которые нужны всем; данные отправителя читаются отдельно
+MESSAGE_COLUMNS = "id, recipient_id, sender_id, message_text, media_count, sent_date, is_read, reply_to_message_id"
+SENDER_COLUMNS = "senders.username, senders.first_name"
+SENDER_JOIN = "LEFT JOIN senders ON senders.user_id = sender_id"
+
+_NOT_LOADED = object()
+
+
+class MessageRecord:
+    """Сообщение одного вида для админа и обычного пользователя.
+
+    Username и имя отправителя загружаются из базы только при первом
+    обращении, если их не выбрали сразу (для админских экранов).
+    Так же по требованию загружаются file_id фото сообщения.
+    """
+
+    __slots__ = ('id', 'recipient_id', 'sender_id', 'text', 'media_count', 'sent_date',
+                 'is_read', 'reply_to_id', '_sender_username', '_sender_first_name', '_media', '_db')
+
+    def __init__(self, row, db=None, sender=None):
+        (self.id, self.recipient_id, self.sender_id, self.text, self.media_count,
+         self.sent_date, self.is_read, self.reply_to_id) = row
+        self._db = db
+        self._media = _NOT_LOADED if self.media_count else []
+        if sender is None:
+            self._sender_username = self._sender_first_name = _NOT_LOADED
+        else:
+            self._sender_username, self._sender_first_name = sender
+
+    @classmethod
+    def from_row(cls, row, db, with_sender):
+        """Собирает запись из строки MESSAGE_COLUMNS (+ SENDER_COLUMNS при with_sender)"""
+        if with_sender:
+            return cls(row[:8], db, row[8:10])
+        return cls(row, db)
+
+    def _load_sender(self):
+        if self._db is None:
+            self._sender_username = self._sender_first_name = None
+        else:
+            self._sender_username, self._sender_first_name = self._db.get_sender_profile(self.sender_id)
+
+    @property
+    def sender_username(self):
+        if self._sender_username is _NOT_LOADED:
+            self._load_sender()
+        return self._sender_username
+
+    @property
+    def sender_first_name(self):
+        if self._sender_first_name is _NOT_LOADED:
+            self._load_sender()
+        return self._sender_first_name
+
+    @property
+    def media(self):
+        """file_id фото сообщения (несколько для альбома)"""
+        if self._media is _NOT_LOADED:
+            self._media = self._db.get_message_media(self.id) if self._db is not None else []
+        return self._media
+
+    @property
+    def photo_id(self):
+        return self.media[0] if self.media else None
+
+    def __repr__(self):
+        return f"MessageRecord(id={self.id}, recipient_id={self.recipient_id}, sender_id={self.sender_id})"
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from telegram.request import BaseRequest
+
+from capture import START_TARGET_PREFIX, read_capture
+from loop_monitor import callback_prefix
+
+# Методы, которые в ответ отдают отправленное или измененное сообщение
+MESSAGE_METHODS = frozenset({
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendVideo', 'sendAnimation', 'sendAudio',
+    'sendVoice', 'copyMessage', 'forwardMessage', 'editMessageText', 'editMessageCaption',
+    'editMessageReplyMarkup', 'editMessageMedia',
+})
+
+
+class StubRequest(BaseRequest):
+    """Bot API без сети: на каждый вызов сразу отвечает правдоподобным результатом"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    def _message(self, params, **fields):
+        self.message_id += 1
+        message = {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        message.update(fields)
+        return message
+
+    def result(self, method, params):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Replay', 'username': 'replay_bot'}
+        if method == 'sendMediaGroup':
+            media = params.get('media', [])
+            if isinstance(media, str):
+                media = json.loads(media)
+            return [self._message(params) for _ in media]
+        if method in MESSAGE_METHODS:
+            return self._message(params)
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        name = url.rsplit('/', 1)[-1]
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({'ok': True, 'result': self.result(name, params)}).encode()
+
+
+def resolve_start_links(update_data, db):
+    """Подставляет в /start ссылку из новой базы вместо псевдонима владельца"""
+    message = update_data.get('message') or {}
+    command, _, target = (message.get('text') or '').partition(' ')
+    if not command.startswith('/start') or not target.startswith(START_TARGET_PREFIX):
+        return
+    owner_id = int(target[len(START_TARGET_PREFIX):])
+    link = db.get_user_link(owner_id) or db.add_user(owner_id, None, None)
+    message['text'] = f"{command} {link}"
+
+
+def timed_handlers(application, timings):
+    """Оборачивает обработчики: время каждого вызова по имени (и коду кнопки)"""
+    def wrap(callback):
+        @functools.wraps(callback)
+        async def timed(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                prefix = callback_prefix(update)
+                name = f"{callback.__name__}:{prefix}" if prefix else callback.__name__
+                timings[name].append((time.perf_counter() - started) * 1000)
+        return timed
+
+    # Служебные группы (захват, учет активности) в отчет не попадают
+    for group, handlers in application.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            handler.callback = wrap(handler.callback)
+
+
+async def replay(capture_path, speed, latency):
+    """Прогоняет захват через обработчики бота и печатает отчет"""
+    from telegram import Update
+    from telegram.ext import Application
+
+    import bot
+    from config import ADMIN_IDS
+
+    admins, updates = read_capture(capture_path)
+    # Псевдонимы админов захвата - админы повтора
+    ADMIN_IDS[:] = admins
+
+    request = StubRequest(latency)
+    application = (Application.builder().token('1:replay')
+                   .request(request).get_updates_request(StubRequest()).build())
+    bot.register_handlers(application)
+    timings = defaultdict(list)
+    timed_handlers(application, timings)
+
+    await application.initialize()
+    await application.start()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for offset, update_data in updates:
+        if speed:
+            delay = started + offset / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        resolve_start_links(update_data, bot.db)
+        await application.update_queue.put(Update.de_json(update_data, application.bot))
+    await application.update_queue.join()
+    elapsed = loop.time() - started
+
+    await application.stop()
+    # После остановки JobQueue задача запуска фоновых задач уже не сработает
+    await bot.stop_background_tasks(application)
+    await application.shutdown()
+
+    print(f"обновлений: {len(updates)}, {elapsed:.2f} с, {len(updates) / elapsed:.0f} обновлений/с, "
+          f"вызовов Bot API: {sum(request.calls.values())}")
+    print(bot.lag_monitor.format_text())
+    print(f"{'обработчик':<32} {'вызовов':>8} {'сред.':>8} {'p50':>8} {'p95':>8} {'макс.':>8}  (мс)")
+    for name, latencies in sorted(timings.items(), key=lambda item: -sum(item[1])):
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, len(latencies) * 95 // 100)]
+        print(f"{name:<32} {len(latencies):>8} {statistics.mean(latencies):>8.2f} "
+              f"{statistics.median(latencies):>8.2f} {p95:>8.2f} {latencies[-1]:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Повтор захваченного трафика на чистой базе без Telegram")
+    parser.add_argument('capture', help="JSONL-файл захвата (CAPTURE_PATH)")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="ускорение относительно записи, например 1, 10, 100; 0 - без пауз")
+    parser.add_argument('--latency', type=float, default=0.0, help="имитация задержки Bot API, сек")
+    parser.add_argument('--dir', help="каталог для базы повтора (по умолчанию временный)")
+    args = parser.parse_args()
+
+    capture_path = os.path.abspath(args.capture)
+    work_dir = args.dir or tempfile.mkdtemp(prefix='replay-')
+    os.makedirs(work_dir, exist_ok=True)
+    # bot.py открывает базу в текущем каталоге при импорте, захват при повторе не нужен
+    os.chdir(work_dir)
+    os.environ['CAPTURE_PATH'] = ''
+    print(f"база повтора: {work_dir}")
+    asyncio.run(replay(capture_path, args.speed, args.latency))
+
+
+if __name__ == '__main__':
+    main()
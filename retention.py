@@ -0,0 +1,43 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """Правила переноса старых сообщений из рабочей таблицы в архив"""
+
+    def __init__(self, days=180, include_unread=False, batch_size=500, max_batches=100, compress=True):
+        self.days = days
+        self.include_unread = include_unread
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.compress = compress
+
+    @property
+    def enabled(self):
+        return self.days > 0
+
+    def cutoff_date(self):
+        """Дата, раньше которой сообщения уходят в архив"""
+        return (datetime.now() - timedelta(days=self.days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    async def run(self, db):
+        """Переносит сообщения в архив порциями, уступая цикл событий между ними"""
+        if not self.enabled:
+            return 0
+        
+        cutoff = self.cutoff_date()
+        total = 0
+        for _ in range(self.max_batches):
+            moved = db.archive_messages(cutoff, self.include_unread, self.batch_size, self.compress)
+            total += moved
+            if moved < self.batch_size:
+                break
+            # Короткие транзакции с паузой: обработчики успевают записывать сообщения
+            await asyncio.sleep(0)
+        
+        if total:
+            logger.info(f"В архив перенесено сообщений: {total}")
+        return total
@@ -0,0 +1,112 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackRequest:
+    """Данные нажатия кнопки, которые получает обработчик действия"""
+
+    __slots__ = ('update', 'context', 'query', 'user_id', 'is_admin', 'args', 'message')
+
+    def __init__(self, update, context, args, is_admin):
+        self.update = update
+        self.context = context
+        self.query = update.callback_query
+        self.user_id = update.effective_user.id
+        self.is_admin = is_admin
+        self.args = args
+        self.message = None
+
+
+class CallbackRouter:
+    """Таблица действий кнопок: callback_data вида "код:арг1:арг2" -> обработчик"""
+
+    SEPARATOR = ":"
+
+    def __init__(self, is_admin, message_loader):
+        self.is_admin = is_admin
+        self.message_loader = message_loader
+        self.routes = {}
+        self.aliases = {}
+        # Код действия -> [число вызовов, суммарное время, максимум]
+        self.timings = {}
+
+    def route(self, action, admin_only=False, load_message=False, legacy=None):
+        """Регистрирует обработчик действия.
+
+        load_message - загрузить сообщение по первому аргументу до вызова обработчика,
+        legacy - прежнее имя callback_data, чтобы работали кнопки в уже отправленных сообщениях.
+        """
+        def decorator(handler):
+            self.routes[action] = (handler, admin_only, load_message)
+            if legacy:
+                self.aliases[legacy] = action
+            return handler
+        return decorator
+
+    @classmethod
+    def encode(cls, action, *args):
+        """Собирает callback_data для кнопки"""
+        return cls.SEPARATOR.join((action, *map(str, args)))
+
+    def decode(self, data):
+        """Разбирает callback_data в код действия и аргументы"""
+        if self.SEPARATOR in data or data in self.routes:
+            action, *args = data.split(self.SEPARATOR)
+            return action, args
+
+        # Старый формат: имя_действия_123_456
+        name, args = data, []
+        while True:
+            head, _, tail = name.rpartition("_")
+            if not head or not tail.isdigit():
+                break
+            args.insert(0, tail)
+            name = head
+        return self.aliases.get(name, name), args
+
+    async def dispatch(self, update, context):
+        """Находит обработчик по коду действия и вызывает его"""
+        query = update.callback_query
+        await query.answer()
+
+        action, args = self.decode(query.data)
+        route = self.routes.get(action)
+        if route is None:
+            logger.warning(f"Неизвестная кнопка: {query.data}")
+            return
+        handler, admin_only, load_message = route
+
+        request = CallbackRequest(update, context, args, self.is_admin(update.effective_user.id))
+        if admin_only and not request.is_admin:
+            return
+
+        started = time.perf_counter()
+        try:
+            if load_message:
+                request.message = self.message_loader(int(args[0]), request.user_id, request.is_admin)
+                if request.message is None:
+                    await query.edit_message_text("❌ Ошибка загрузки сообщения")
+                    return
+            await handler(request)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике кнопки {action}: {e}")
+            await query.edit_message_text("❌ Произошла ошибка. Попробуйте еще раз.")
+        finally:
+            elapsed = time.perf_counter() - started
+            timing = self.timings.setdefault(action, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+
+    def format_text(self, top=5):
+        """Строка с самыми затратными кнопками для админ-панели: ср./макс. по суммарному времени"""
+        heaviest = sorted(self.timings.items(), key=lambda item: -item[1][1])[:top]
+        if not heaviest:
+            return "🔘 Кнопки: нет данных"
+        # Панель отправляется с parse_mode=Markdown: "_" в кодах действий открыл бы курсив
+        return "🔘 Кнопки, ср./макс.: " + ", ".join(
+            "{} {:.0f}/{:.0f} мс ×{}".format(action.replace("_", "\\_"), total / count * 1000, peak * 1000, count)
+            for action, (count, total, peak) in heaviest
+        )
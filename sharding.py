@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import functools
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+def shard_paths(db_name, shards):
+    """Имена файлов шардов рядом с основной базой"""
+    base, ext = os.path.splitext(db_name)
+    return [f"{base}.shard{i}{ext or '.db'}" for i in range(shards)]
+
+
+class ShardedDatabase(Database):
+    """База, в которой сообщения разложены по нескольким файлам SQLite.
+
+    Пользователи, настройки, баны и рассылки остаются в основном файле.
+    Сообщение хранится в шарде recipient_id % N, а его id выдается так,
+    что id % N - номер того же шарда, поэтому поиск по id не требует таблицы
+    маршрутов.
+
+    У каждого шарда два соединения: для чтения в цикле событий и для записи
+    в своем потоке. Обработчики пишут через *_async: запись шарда идет в его
+    потоке, не занимая цикл, а записи в разные шарды (и их fsync) идут
+    параллельно. Синхронные методы записи берут ту же блокировку шарда.
+    """
+
+    def __init__(self, db_name='bot_database.db', shards=2, archive_path=None, **kwargs):
+        super().__init__(db_name, archive_path=archive_path, **kwargs)
+        archive_paths = shard_paths(archive_path, shards) if archive_path else [None] * shards
+        self.shards = [
+            Database(path, archive_path=archive)
+            for path, archive in zip(shard_paths(db_name, shards), archive_paths)
+        ]
+        self.writers = [
+            Database(path, archive_path=archive)
+            for path, archive in zip(shard_paths(db_name, shards), archive_paths)
+        ]
+        self.shard_locks = [threading.Lock() for _ in self.shards]
+        self.executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"shard{i}") for i in range(shards)
+        ]
+
+        # Кэши сообщений общие: шард сам обновляет их при прочтении и архивировании
+        for shard in self.shards + self.writers:
+            shard.message_cache = self.message_cache
+            shard.thread_roots = self.thread_roots
+            # Пользователи (и признак админа) только в основной базе
+            shard.is_admin = self.is_admin
+
+        self.next_ids = [self.first_free_id(i) for i in range(shards)]
+
+        self.cursor.execute("SELECT 1 FROM messages LIMIT 1")
+        if self.cursor.fetchone():
+            logger.warning("В основной базе есть сообщения, в режиме шардирования они не видны")
+
+    def first_free_id(self, index):
+        """Первый свободный id шарда; sqlite_sequence не уменьшается при удалении и архивировании"""
+        shard = self.writers[index]
+        shard.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'")
+        row = shard.cursor.fetchone()
+        last_id = row[0] if row else 0
+        count = len(self.shards)
+        return last_id + ((index - last_id - 1) % count) + 1
+
+    def shard_for_recipient(self, recipient_id):
+        return recipient_id % len(self.shards)
+
+    def shard_for_message(self, message_id):
+        return self.shards[message_id % len(self.shards)]
+
+    def shard_write(self, index, write, *args, **kwargs):
+        """Вызывает запись шарда write(writer, ...) на его соединении для записи под блокировкой шарда"""
+        with self.shard_locks[index]:
+            return write(self.writers[index], *args, **kwargs)
+
+    async def shard_write_async(self, index, write, *args, **kwargs):
+        """То же в потоке шарда: цикл событий не ждет запись и fsync"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executors[index], functools.partial(self.shard_write, index, write, *args, **kwargs)
+        )
+
+    def _save_message(self, writer, index, recipient_id, sender_id, sender_username, sender_first_name,
+                      message_text, media, reply_to_id, notify):
+        """Выдает id шарда и сохраняет сообщение (вызывается под блокировкой шарда)"""
+        message_id = self.next_ids[index]
+        self.next_ids[index] += len(self.shards)
+        return writer.save_anonymous_message(
+            recipient_id, sender_id, sender_username, sender_first_name,
+            message_text, media, reply_to_id, message_id=message_id, notify=notify
+        )
+
+    def save_anonymous_message(self, recipient_id, sender_id, sender_username, sender_first_name,
+                               message_text=None, media=None, reply_to_id=None, notify=False):
+        """Сохраняет сообщение (и уведомление в outbox) в шард получателя"""
+        index = self.shard_for_recipient(recipient_id)
+        return self.shard_write(index, self._save_message, index, recipient_id, sender_id, sender_username,
+                                sender_first_name, message_text, media, reply_to_id, notify)
+
+    async def save_anonymous_message_async(self, recipient_id, sender_id, sender_username, sender_first_name,
+                                           message_text=None, media=None, reply_to_id=None, notify=False):
+        """Сохраняет сообщение в потоке шарда получателя"""
+        index = self.shard_for_recipient(recipient_id)
+        return await self.shard_write_async(
+            index, self._save_message, index, recipient_id, sender_id, sender_username, sender_first_name,
+            message_text, media, reply_to_id, notify
+        )
+
+    def get_user_messages(self, user_id, requesting_user_id=None):
+        """Получает все сообщения пользователя из его шарда"""
+        return self.shards[self.shard_for_recipient(user_id)].get_user_messages(user_id, requesting_user_id)
+
+    def get_unread_count(self, user_id):
+        """Получает количество непрочитанных сообщений"""
+        return self.shards[self.shard_for_recipient(user_id)].get_unread_count(user_id)
+
+    def mark_message_as_read(self, message_id):
+        """Отмечает сообщение как прочитанное"""
+        self.shard_write(message_id % len(self.shards), Database.mark_message_as_read, message_id)
+
+    async def mark_message_as_read_async(self, message_id):
+        """Отмечает сообщение как прочитанное в потоке шарда"""
+        await self.shard_write_async(message_id % len(self.shards), Database.mark_message_as_read, message_id)
+
+    def load_message(self, message_id, requesting_user_id=None):
+        """Читает сообщение из шарда по id; админу - сразу с отправителем"""
+        return self.shard_for_message(message_id).load_message(message_id, requesting_user_id)
+
+    def has_replies(self, message_id):
+        """Проверяет, есть ли ответы на сообщение (ответ может лежать в любом шарде)"""
+        return any(shard.has_replies(message_id) for shard in self.shards)
+
+    def add_recipient_names(self, rows):
+        """Дописывает имена получателей из основной базы в строки админских выборок"""
+        recipient_ids = list({row[4] for row in rows})
+        names = {}
+        if recipient_ids:
+            placeholders = ",".join("?" * len(recipient_ids))
+            self.cursor.execute(f'''
+                SELECT user_id, username, first_name FROM users WHERE user_id IN ({placeholders})
+            ''', recipient_ids)
+            names = {user_id: (username, first_name) for user_id, username, first_name in self.cursor.fetchall()}
+        return [row[:9] + names.get(row[4], (None, None)) for row in rows]
+
+    def get_messages_page(self, before_id=None, limit=15, **message_filters):
+        """Получает страницу сообщений всех шардов, слитых по id"""
+        results = [shard.get_messages_page(before_id, limit + 1, **message_filters)[0] for shard in self.shards]
+        rows = list(islice(heapq.merge(*results, key=lambda row: row[0], reverse=True), limit + 1))
+
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return self.add_recipient_names(rows[:limit]), next_cursor
+
+    def search_messages(self, query, limit=10, offset=0, order='id'):
+        """Ищет во всех шардах; ранги FTS разных файлов несравнимы, поэтому новые первыми.
+
+        Каждый шард отдает свои первые offset + limit совпадений в том же порядке
+        по id, поэтому их слияние содержит первые offset + limit совпадений всей
+        базы и страницы не повторяются и не теряют результатов.
+        """
+        results = []
+        has_more = False
+        for shard in self.shards:
+            rows, shard_has_more = shard.search_messages(query, limit=offset + limit, offset=0, order='id')
+            results.append(rows)
+            has_more = has_more or shard_has_more
+        rows = list(heapq.merge(*results, key=lambda row: row[0], reverse=True))
+        return rows[offset:offset + limit], has_more or len(rows) > offset + limit
+
+    def get_thread_root(self, message_id, max_depth=50):
+        """Находит корень переписки, поднимаясь по ответам через шарды"""
+        if message_id in self.thread_roots:
+            self.thread_roots.move_to_end(message_id)
+            return self.thread_roots[message_id]
+
+        root_id = None
+        current = message_id
+        for _ in range(max_depth + 1):
+            shard = self.shard_for_message(current)
+            shard.cursor.execute("SELECT reply_to_message_id FROM messages WHERE id = ?", (current,))
+            row = shard.cursor.fetchone()
+            if row is None:
+                break
+            root_id = current
+            if row[0] is None:
+                break
+            current = row[0]
+
+        if root_id is not None:
+            self.cache_thread_root(message_id, root_id)
+        return root_id
+
+    def get_thread(self, root_id, participant_id=None, after_id=0, limit=20,
+                   max_depth=50, max_messages=500):
+        """Получает страницу переписки: обход ответов по уровням во всех шардах"""
+        depths = {root_id: 0}
+        level = [root_id]
+        for depth in range(1, max_depth + 1):
+            if not level or len(depths) >= max_messages:
+                break
+            placeholders = ",".join("?" * len(level))
+            children = []
+            for shard in self.shards:
+                shard.cursor.execute(f'''
+                    SELECT id FROM messages WHERE reply_to_message_id IN ({placeholders})
+                ''', level)
+                children.extend(row[0] for row in shard.cursor.fetchall())
+            level = sorted(children)[:max_messages - len(depths)]
+            depths.update((message_id, depth) for message_id in level)
+
+        ids = [message_id for message_id in depths if message_id > after_id]
+        rows = []
+        for index, shard in enumerate(self.shards):
+            shard_ids = [message_id for message_id in ids if message_id % len(self.shards) == index]
+            if not shard_ids:
+                continue
+            placeholders = ",".join("?" * len(shard_ids))
+            shard.cursor.execute(f'''
+                SELECT id, sender_id, recipient_id, message_text, media_count, sent_date
+                FROM messages
+                WHERE id IN ({placeholders})
+                  AND (? IS NULL OR sender_id = ? OR recipient_id = ?)
+            ''', (*shard_ids, participant_id, participant_id, participant_id))
+            rows.extend(row + (depths[row[0]],) for row in shard.cursor.fetchall())
+        rows.sort(key=lambda row: row[0])
+
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def archive_messages(self, cutoff_date, include_unread=False, batch_size=500, compress=True):
+        """Переносит по порции старых сообщений в архив каждого шарда"""
+        moved = 0
+        for index in range(len(self.shards)):
+            moved += self.shard_write(index, Database.archive_messages, cutoff_date, include_unread, batch_size, compress)
+        return moved
+
+    def recount_stats(self):
+        """Пересчитывает счетчики основной базы и всех шардов"""
+        super().recount_stats()
+        for shard in getattr(self, 'shards', []):
+            shard.recount_stats()
+
+    def get_stats(self):
+        """Складывает счетчики шардов; активные отправители - объединение по шардам"""
+        self.cursor.execute("SELECT value FROM stats_counters WHERE name = 'users'")
+        stats = {'users': self.cursor.fetchone()[0]}
+
+        today = datetime.now().strftime("%Y-%m-%d")
+        active_senders = set()
+        for shard in self.shards:
+            shard.cursor.execute("SELECT name, value FROM stats_counters WHERE name != 'users'")
+            for name, value in shard.cursor.fetchall():
+                stats[name] = stats.get(name, 0) + value
+            shard.cursor.execute("SELECT DISTINCT sender_id FROM messages WHERE sent_date >= ?", (today,))
+            active_senders.update(row[0] for row in shard.cursor.fetchall())
+        stats['active_senders'] = len(active_senders)
+        return stats
+
+
+def benchmark(db_name, shards, concurrency, messages):
+    """Пишет сообщения из concurrency одновременных обработчиков, как бот.
+
+    Возвращает (сообщений в секунду, самая долгая задержка цикла событий в секундах).
+    Запись в разные шарды идет в разных потоках параллельно, пока sqlite и fsync
+    не держат GIL, поэтому рост с числом шардов ограничен числом ядер.
+    """
+    db = ShardedDatabase(db_name, shards=shards) if shards > 1 else Database(db_name)
+
+    async def handler(count):
+        for _ in range(count):
+            recipient_id = random.randrange(1, 10 ** 9)
+            await db.save_anonymous_message_async(recipient_id, 1, 'bench', 'Bench', 'benchmark message')
+
+    async def ticker(lags, done):
+        # Насколько цикл событий опаздывает проснуться, пока идет запись
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            expected = loop.time() + 0.001
+            await asyncio.sleep(0.001)
+            lags.append(loop.time() - expected)
+
+    async def run():
+        lags, done = [], asyncio.Event()
+        watcher = asyncio.create_task(ticker(lags, done))
+        started = time.perf_counter()
+        await asyncio.gather(*(handler(messages // concurrency) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await watcher
+        return messages / elapsed, max(lags, default=0.0)
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер скорости записи сообщений по числу шардов")
+    parser.add_argument('--db', default='bench.db', help="основной файл базы (шарды создаются рядом)")
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=32, help="одновременных обработчиков")
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"ядер: {os.cpu_count()}")
+    for shards in args.shards:
+        db_name = f"{os.path.splitext(args.db)[0]}-{shards}.db"
+        rate, max_lag = benchmark(db_name, shards, args.concurrency, args.messages)
+        print(f"шардов: {shards}, обработчиков: {args.concurrency}: {rate:.0f} сообщений/с, "
+              f"макс. задержка цикла {max_lag * 1000:.1f} мс")
+
+
+if __name__ == '__main__':
+    main()
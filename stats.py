@@ -0,0 +1,38 @@
+import time
+from datetime import datetime
+
+
+class StatsCache:
+    """Хранит снимок статистики для админ-панели и обновляет его по таймеру"""
+
+    def __init__(self, db, ttl=60):
+        self.db = db
+        self.ttl = ttl
+        self.snapshot = None
+        self.updated_at = 0.0
+        self.updated_label = None
+
+    def refresh(self):
+        """Пересобирает снимок статистики из счетчиков базы данных"""
+        self.snapshot = self.db.get_stats()
+        self.updated_at = time.monotonic()
+        self.updated_label = datetime.now().strftime("%H:%M:%S")
+        return self.snapshot
+
+    def get(self):
+        """Возвращает снимок статистики, обновляя его только если он устарел"""
+        if self.snapshot is None or time.monotonic() - self.updated_at > self.ttl:
+            return self.refresh()
+        return self.snapshot
+
+    def format_text(self):
+        """Формирует текст статистики для админ-панели"""
+        stats = self.get()
+        cache = self.db.get_message_cache_stats()
+        return (f"👥 Пользователей: {stats.get('users', 0)}\n"
+                f"💬 Сообщений: {stats.get('messages', 0)} (в архиве: {stats.get('archived', 0)})\n"
+                f"📌 Непрочитанных: {stats.get('unread', 0)}\n"
+                f"📸 Фото: {stats.get('photos', 0)}\n"
+                f"🔥 Активных отправителей сегодня: {stats.get('active_senders', 0)}\n"
+                f"🧠 Кэш сообщений: {cache['size']} шт., попаданий {cache['hits']}, промахов {cache['misses']}\n"
+                f"🕒 Обновлено: {self.updated_label}\n")
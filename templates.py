@@ -0,0 +1,111 @@
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from router import CallbackRouter
+
+HELP_TEXT = (
+    "📚 **Как пользоваться ботом:**\n\n"
+    "1️⃣ **Получите ссылку** - нажмите /start\n"
+    "2️⃣ **Отправьте ссылку** друзьям\n"
+    "3️⃣ **Они напишут вам** анонимно (текст или фото)\n"
+    "4️⃣ **Вы получите уведомление** с кнопкой ответа\n"
+    "5️⃣ **Нажмите 'Ответить'** чтобы продолжить диалог\n\n"
+    "📸 **Поддерживаются фото с подписями!**\n\n"
+    "🔐 **Всё полностью анонимно!**"
+)
+
+
+class Templates:
+    """Клавиатуры и тексты меню, собранные один раз при запуске"""
+
+    def __init__(self, bot_username):
+        self.link_prefix = f"https://t.me/{bot_username}?start="
+        cb = CallbackRouter.encode
+
+        # Объекты клавиатур в PTB неизменяемы, поэтому их можно отдавать всем пользователям
+        menu_rows = [
+            [InlineKeyboardButton("📨 Мои сообщения", callback_data=cb("msgs"))],
+            [InlineKeyboardButton("🔄 Моя ссылка", callback_data=cb("link"))],
+            [InlineKeyboardButton("❓ Помощь", callback_data=cb("help"))]
+        ]
+        self.main_menu = InlineKeyboardMarkup(menu_rows)
+        self.admin_menu = InlineKeyboardMarkup(
+            menu_rows + [[InlineKeyboardButton("👑 Админ-панель", callback_data=cb("adm"))]]
+        )
+        self.back_to_menu = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data=cb("menu"))]])
+        self.help_text = HELP_TEXT
+
+    def menu_keyboard(self, is_admin):
+        return self.admin_menu if is_admin else self.main_menu
+
+    def bot_link(self, unique_link):
+        return self.link_prefix + unique_link
+
+    def render(self, view, first_name, unique_link, unread_count, is_admin):
+        """Заполняет шаблон меню данными пользователя"""
+        bot_link = self.bot_link(unique_link)
+        if view == 'start':
+            text = (
+                f"👋 Привет, {first_name}!\n\n"
+                f"🔗 Твоя ссылка для анонимных сообщений:\n"
+                f"`{bot_link}`\n\n"
+                f"📊 Непрочитанных: {unread_count}\n\n"
+                f"📸 Можно отправлять фото с подписями!"
+            )
+            if is_admin:
+                text += "\n\n👑 **Вы администратор!**"
+            return text
+        if view == 'menu':
+            return (
+                f"👋 **{first_name}**, добро пожаловать!\n\n"
+                f"🔗 **Твоя ссылка:**\n"
+                f"`{bot_link}`\n\n"
+                f"📊 **Непрочитанных:** {unread_count}"
+            )
+        if view == 'link':
+            return f"🔗 **Ваша ссылка:**\n`{bot_link}`\n\n📊 **Непрочитанных:** {unread_count}"
+        raise ValueError(f"Неизвестный шаблон: {view}")
+
+
+class MenuCache:
+    """Готовые тексты меню по пользователям; сбрасываются при изменении непрочитанных"""
+
+    def __init__(self, db, templates, size=10000):
+        self.db = db
+        self.templates = templates
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, view, user_id, first_name, is_admin):
+        """Возвращает текст меню, обращаясь к базе только при промахе"""
+        entry = self.entries.get(user_id)
+        if entry is None:
+            unique_link = self.db.get_user_link(user_id)
+            if unique_link is None:
+                return None
+            entry = self.entries[user_id] = {
+                'link': unique_link,
+                'unread': self.db.get_unread_count(user_id),
+                'texts': {}
+            }
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(user_id)
+
+        key = (view, first_name, is_admin)
+        text = entry['texts'].get(key)
+        if text is None:
+            text = entry['texts'][key] = self.templates.render(
+                view, first_name, entry['link'], entry['unread'], is_admin
+            )
+        return text
+
+    def invalidate(self, *user_ids):
+        """Сбрасывает меню пользователей, у которых изменились непрочитанные"""
+        for user_id in user_ids:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        self.entries.clear()